@@ -1,13 +1,48 @@
+import hashlib
+import hmac
+import math
 import os
+import queue
 import sqlite3
-from flask import Flask, jsonify, request, g
+import threading
+import time
+from flask import Flask, jsonify, request, g, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import bcrypt
+import orjson
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import connection as ConexaoPsycopg, cursor as CursorPsycopg
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from datetime import datetime
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import lru_cache, wraps
+
+# ========================================
+# SERIALIZAÇÃO JSON (ORJSON)
+# ========================================
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify/get_json via orjson (C): mesma saída compacta, serialização e parsing bem mais rápidos.
+    Datas e Decimal continuam no formato do provider padrão do Flask (http_date / str)."""
+    opcoes = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.opcoes).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        corpo = orjson.dumps(obj, default=self.default, option=self.opcoes | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(corpo, mimetype=self.mimetype)
 
 app = Flask(__name__)
+# Só neste app: outras instâncias de Flask no processo continuam com o provider padrão
+app.json = OrjsonProvider(app)
 
 # ========================================
 # CONFIGURAÇÃO DE CORS CORRIGIDA
@@ -23,34 +58,603 @@ CORS(app, resources={
 
 DATABASE = 'restaurante.db'
 
+# PRAGMAs aplicados a cada conexão SQLite: WAL (escritas só anexam ao log e leitores não bloqueiam),
+# fsync apenas nos checkpoints, cache/temporários em memória e integridade referencial ativa
+SQLITE_PRAGMAS = '''
+    PRAGMA journal_mode = WAL;
+    PRAGMA synchronous = NORMAL;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA mmap_size = 268435456;
+    PRAGMA cache_size = -20000;
+    PRAGMA foreign_keys = ON;
+'''
+
+# Conexões mantidas abertas por processo e reaproveitadas entre requisições
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+
+# O banco não muda durante a vida do processo: decide uma única vez (e não a cada requisição)
+IS_POSTGRES = os.environ.get('DATABASE_URL') is not None
+PH = '%s' if IS_POSTGRES else '?'
+
+# ========================================
+# CONSULTAS SQL PRÉ-MONTADAS
+# Texto fixo por processo: o driver reaproveita o statement já compilado e
+# os handlers não remontam strings nem repetem o teste de backend.
+# ========================================
+# Itens da comanda agregados em JSON pelo próprio banco (cada dialeto tem suas funções)
+_ITEM_COMANDA_JSON = ('json_build_object' if IS_POSTGRES else 'json_object') + '''(
+                'id', ci.id, 'produto_id', ci.produto_id, 'produto_nome', p.nome,
+                'quantidade', ci.quantidade, 'preco_unitario', ci.preco_unitario,
+                'subtotal', ci.quantidade * ci.preco_unitario, 'observacoes', ci.observacoes
+            )'''
+_ITENS_COMANDA_JSON = (
+    f"COALESCE(json_agg({_ITEM_COMANDA_JSON} ORDER BY ci.id) FILTER (WHERE ci.id IS NOT NULL), '[]')"
+    if IS_POSTGRES else
+    f"json_group_array({_ITEM_COMANDA_JSON}) FILTER (WHERE ci.id IS NOT NULL)"
+)
+
+# Colunas (e chaves do JSON) das listagens: a mesma tupla monta o SELECT e os dicts da resposta
+COLUNAS_PRODUTO = ('id', 'nome', 'preco_venda')
+COLUNAS_MESA = ('id', 'numero', 'capacidade', 'localizacao', 'status')
+COLUNAS_INSUMO = ('id', 'nome', 'unidade_medida', 'quantidade_estoque', 'estoque_minimo', 'preco_unitario', 'fornecedor')
+
+# Listagem de comandas com o total calculado pelo preco_unitario gravado em comanda_itens
+_SELECT_COMANDAS = '''
+    SELECT 
+        c.id, c.data_abertura, c.data_fechamento, c.status,
+        m.numero as numero_mesa, m.id as mesa_id,
+        COALESCE(SUM(ci.quantidade * ci.preco_unitario), 0.0) as valor_total
+    FROM comandas c
+    JOIN mesas m ON c.mesa_id = m.id
+    LEFT JOIN comanda_itens ci ON c.id = ci.comanda_id
+    {filtro}
+    GROUP BY c.id, m.id, m.numero, c.data_abertura, c.data_fechamento, c.status ORDER BY c.data_abertura DESC
+'''
+
+# Quantidades de estoque são REAL: somas de frações (3 x 0.1) não fecham exatamente, então a
+# baixa compara com uma folga e grava o saldo arredondado (o "+ 0.0" evita gravar -0.0)
+ESTOQUE_TOLERANCIA = 1e-9
+ESTOQUE_CASAS = 6
+
+SQL = {
+    # Usuários / autenticação
+    # LOWER(username) casa com o índice idx_usuarios_username_lower
+    'sel_usuario_login': f'SELECT id, username, password_hash FROM usuarios WHERE LOWER(username) = LOWER({PH})',
+    'ins_usuario': f'INSERT INTO usuarios (username, password_hash) VALUES ({PH}, {PH}) ON CONFLICT DO NOTHING RETURNING id',
+    'upd_senha_usuario': f'UPDATE usuarios SET password_hash = {PH} WHERE id = {PH}',
+    'conta_usuarios': 'SELECT COUNT(*) as total FROM usuarios',
+    'sel_usuarios': 'SELECT id, username, data_criacao FROM usuarios',
+    # Produtos
+    'sel_produtos': f"SELECT {', '.join(COLUNAS_PRODUTO)} FROM produtos ORDER BY nome",
+    'ins_produto': f"INSERT INTO produtos (nome, preco_venda) VALUES ({PH}, {PH}) RETURNING {', '.join(COLUNAS_PRODUTO)}",
+    'del_produto': f'DELETE FROM produtos WHERE id = {PH}',
+    'conta_produtos': 'SELECT COUNT(*) as total FROM produtos',
+    # Mesas
+    'sel_mesas': f"SELECT {', '.join(COLUNAS_MESA)} FROM mesas ORDER BY numero",
+    'sel_mesas_por_status': f"SELECT {', '.join(COLUNAS_MESA)} FROM mesas WHERE status = {PH} ORDER BY numero",
+    'ins_mesa': f"INSERT INTO mesas (numero, capacidade, localizacao) VALUES ({PH}, {PH}, {PH}) RETURNING {', '.join(COLUNAS_MESA)}",
+    'upd_mesa_status': f'UPDATE mesas SET status = {PH} WHERE id = {PH}',
+    'sel_mesa_status': f'SELECT id, status FROM mesas WHERE id = {PH}',
+    # Ocupa a mesa só se ela estiver disponível: verificação e troca de status no mesmo UPDATE
+    # (no PostgreSQL a trava da linha faz uma segunda abertura simultânea ver a mesa já ocupada)
+    'ocupa_mesa': f"UPDATE mesas SET status = 'ocupada' WHERE id = {PH} AND status = 'disponivel' RETURNING id",
+    # Comandas
+    'ins_comanda': f'INSERT INTO comandas (mesa_id) VALUES ({PH}) RETURNING id',
+    # PostgreSQL: ocupa a mesa e cria a comanda num único statement (nenhuma linha = mesa indisponível)
+    'abre_comanda': '''
+        WITH mesa AS (
+            UPDATE mesas SET status = 'ocupada' WHERE id = %s AND status = 'disponivel' RETURNING id
+        )
+        INSERT INTO comandas (mesa_id) SELECT id FROM mesa RETURNING id
+    ''',
+    'sel_comandas': _SELECT_COMANDAS.format(filtro=''),
+    'sel_comandas_por_status': _SELECT_COMANDAS.format(filtro=f'WHERE c.status = {PH}'),
+    'sel_status_preco': f'''
+        SELECT c.status, p.preco_venda 
+        FROM comandas c, produtos p 
+        WHERE c.id = {PH} AND p.id = {PH}
+    ''',
+    # Lança o item num único statement: o preço vem do produto e só grava se a comanda estiver
+    # aberta (nenhuma linha = comanda/produto inexistente ou comanda fechada). Se a combinação
+    # (comanda_id, produto_id) já existir, soma APENAS a quantidade (mantém o preco_unitario
+    # original). No PostgreSQL o FOR SHARE espera um pagamento em andamento da mesma comanda.
+    # O "WHERE" é obrigatório no SQLite para o ON CONFLICT não ser lido como parte do SELECT.
+    'upsert_item_comanda': f'''
+        INSERT INTO comanda_itens (comanda_id, produto_id, quantidade, preco_unitario) 
+        SELECT c.id, p.id, {PH}, p.preco_venda
+        FROM comandas c, produtos p 
+        WHERE c.id = {PH} AND p.id = {PH} AND c.status = 'aberta'
+        {'FOR SHARE OF c' if IS_POSTGRES else ''}
+        ON CONFLICT (comanda_id, produto_id) 
+        DO UPDATE SET quantidade = comanda_itens.quantidade + EXCLUDED.quantidade
+        RETURNING id
+    ''',
+    # Detalhe da comanda: cabeçalho + itens (agregados em JSON pelo banco) numa única consulta.
+    # Enquanto aberta, o total é a soma dos itens; depois de paga, o valor gravado no fechamento.
+    'sel_comanda_detalhes': f'''
+        SELECT
+            c.id, c.mesa_id, m.numero AS mesa_numero, c.status, c.data_abertura, c.data_fechamento,
+            CASE WHEN c.status = 'aberta' THEN COALESCE(SUM(ci.quantidade * ci.preco_unitario), 0.0) ELSE c.total END AS total,
+            {_ITENS_COMANDA_JSON} AS itens
+        FROM comandas c
+        JOIN mesas m ON m.id = c.mesa_id
+        LEFT JOIN comanda_itens ci ON ci.comanda_id = c.id
+        LEFT JOIN produtos p ON p.id = ci.produto_id
+        WHERE c.id = {PH}
+        GROUP BY c.id, m.numero
+    ''',
+    # Pagamento da comanda
+    'lock_comanda': f'SELECT id FROM comandas WHERE id = {PH} FOR UPDATE',
+    'sel_total_comanda': f'''
+        SELECT 
+            c.mesa_id, c.status,
+            COALESCE(SUM(ci.quantidade * ci.preco_unitario), 0.0) as valor_total
+        FROM comandas c
+        LEFT JOIN comanda_itens ci ON c.id = ci.comanda_id
+        WHERE c.id = {PH} GROUP BY c.id, c.mesa_id, c.status
+    ''',
+    'ins_venda': f'''
+        INSERT INTO vendas (comanda_id, valor_total, valor_pago, troco, metodo_pagamento) 
+        VALUES ({PH}, {PH}, {PH}, {PH}, {PH})
+    ''',
+    'fechar_comanda': f'UPDATE comandas SET status = {PH}, data_fechamento = {PH}, total = {PH} WHERE id = {PH}',
+    # PostgreSQL: os passos 3 a 5 do pagamento (venda, fechar comanda, liberar
+    # mesa) num único statement com CTEs de escrita, em uma ida ao banco
+    'finaliza_pagamento': '''
+        WITH venda AS (
+            INSERT INTO vendas (comanda_id, valor_total, valor_pago, troco, metodo_pagamento)
+            VALUES (%s, %s, %s, %s, %s)
+        ), comanda AS (
+            UPDATE comandas SET status = 'paga', data_fechamento = %s, total = %s WHERE id = %s
+        )
+        UPDATE mesas SET status = 'disponivel' WHERE id = %s
+    ''',
+    # Insumos
+    'sel_insumos': f"SELECT {', '.join(COLUNAS_INSUMO)} FROM insumos ORDER BY nome",
+    'sel_insumo': f"SELECT {', '.join(COLUNAS_INSUMO)} FROM insumos WHERE id = {PH}",
+    # RETURNING funciona nos dois bancos (SQLite >= 3.35): a linha gravada volta
+    # no mesmo statement, sem SELECT de releitura.
+    'ret_insumo': f"RETURNING {', '.join(COLUNAS_INSUMO)}",
+    'ins_insumo': f'''
+        INSERT INTO insumos (nome, unidade_medida, quantidade_estoque, estoque_minimo, preco_unitario, fornecedor)
+        VALUES ({PH}, {PH}, {PH}, {PH}, {PH}, {PH})
+        RETURNING {', '.join(COLUNAS_INSUMO)}
+    ''',
+    # Só remove se nenhuma ficha técnica usar o insumo (probe em idx_ficha_itens_insumo)
+    'del_insumo': f'''
+        DELETE FROM insumos
+        WHERE id = {PH} AND NOT EXISTS (SELECT 1 FROM ficha_itens WHERE insumo_id = {PH})
+    ''',
+    'existe_insumo': f'SELECT 1 FROM insumos WHERE id = {PH}',
+    # Fichas técnicas
+    'sel_ficha_produto': f'''
+        SELECT fi.id, fi.insumo_id, i.nome AS insumo_nome, i.unidade_medida, fi.quantidade_necessaria
+        FROM fichas_tecnicas ft
+        JOIN ficha_itens fi ON fi.ficha_id = ft.id
+        JOIN insumos i ON i.id = fi.insumo_id
+        WHERE ft.produto_id = {PH}
+        ORDER BY i.nome
+    ''',
+    # O alias estoque_atual já sai do banco no formato da resposta: sem remontar cada linha
+    'sel_estoque_baixo': '''
+        SELECT id, nome, quantidade_estoque AS estoque_atual, unidade_medida, estoque_minimo
+        FROM insumos
+        WHERE quantidade_estoque <= estoque_minimo
+        ORDER BY nome
+    ''',
+    # Baixa de estoque no pagamento da comanda: o total a baixar de cada insumo (itens x fichas)
+    # sai de uma única consulta
+    # No PostgreSQL também trava as linhas dos insumos, sempre em ordem de id: pagamentos
+    # simultâneos que usam os mesmos insumos esperam na fila em vez de se travarem (deadlock).
+    # O SQLite já serializa os pagamentos com o BEGIN IMMEDIATE.
+    'sel_necessidades_comanda': f'''
+        SELECT i.id, i.nome, n.necessario
+        FROM (
+            SELECT fi.insumo_id, SUM(fi.quantidade_necessaria * ci.quantidade) AS necessario
+            FROM comanda_itens ci
+            JOIN fichas_tecnicas ft ON ft.produto_id = ci.produto_id
+            JOIN ficha_itens fi ON fi.ficha_id = ft.id
+            WHERE ci.comanda_id = {PH}
+            GROUP BY fi.insumo_id
+        ) n
+        JOIN insumos i ON i.id = n.insumo_id
+        ORDER BY i.id
+    ''' + (' FOR UPDATE OF i' if IS_POSTGRES else ''),
+    # Baixa condicional: decrementa e valida o estoque no mesmo statement (sem janela entre o
+    # SELECT e o UPDATE); RETURNING devolve só os insumos que tinham saldo. {valores} recebe
+    # um "(?, ?)" por insumo. O saldo é REAL: a comparação tem folga de ESTOQUE_TOLERANCIA e o
+    # resultado é arredondado, para que usar exatamente o que resta (0.3 - 3 x 0.1) passe e zere.
+    'baixa_estoque_lote': f'''
+        WITH v(id, delta) AS (VALUES {{valores}})
+        UPDATE insumos SET quantidade_estoque =
+            ROUND(CAST(insumos.quantidade_estoque - v.delta AS NUMERIC), {ESTOQUE_CASAS}) + 0.0
+        FROM v
+        WHERE insumos.id = v.id AND insumos.quantidade_estoque - v.delta > -{ESTOQUE_TOLERANCIA}
+        RETURNING insumos.id
+    ''',
+    # Tabela ou índice já existe no banco? (migração de bancos antigos)
+    'existe_objeto': (
+        f'SELECT 1 FROM pg_class WHERE relname = {PH} AND pg_table_is_visible(oid)' if IS_POSTGRES else
+        f'SELECT 1 FROM sqlite_master WHERE name = {PH}'
+    ),
+}
+
+@lru_cache(maxsize=None)
+def sql_update(tabela, campos, retorno=''):
+    """UPDATE parametrizado para um conjunto de campos, montado uma única vez por combinação.
+    Os handlers passam os campos sempre na mesma ordem, então cada subconjunto gera sempre o
+    mesmo texto (e o PostgreSQL reaproveita o plano)."""
+    atribuicoes = ', '.join(f'{campo} = {PH}' for campo in campos)
+    return f'UPDATE {tabela} SET {atribuicoes} WHERE id = {PH} {retorno}'
+
+# ========================================
+# STATEMENTS PREPARADOS (POSTGRESQL)
+# ========================================
+# Consultas do caminho quente do PDV (abrir comanda, lançar item, pagar), a leitura da ficha
+# técnica de um produto e a busca do usuário no login. No PostgreSQL elas são preparadas (PREPARE)
+# uma vez por conexão e executadas com EXECUTE: o servidor deixa de refazer parse e plano a cada
+# chamada. Os handlers pegam o texto por sql_conexao(), que só usa o EXECUTE se aquele statement
+# foi de fato preparado na conexão; senão roda o SQL normal.
+# O SQLite já reaproveita o statement compilado (cached_statements).
+# Só entram consultas de formato fixo; a baixa de estoque, que varia com o número de insumos, fica de fora.
+PREPARADOS = (
+    'lock_comanda', 'sel_total_comanda', 'sel_necessidades_comanda', 'finaliza_pagamento',
+    'upd_mesa_status', 'sel_ficha_produto',
+    'abre_comanda', 'upsert_item_comanda', 'sel_usuario_login',
+)
+SQL_PREPARE = {}  # nome -> PREPARE
+SQL_EXECUTE = {}  # nome -> EXECUTE (mesmos parâmetros da entrada em SQL)
+
+if IS_POSTGRES:
+    for _nome in PREPARADOS:
+        _corpo = SQL[_nome]
+        _total = _corpo.count('%s')
+        for _i in range(1, _total + 1):
+            _corpo = _corpo.replace('%s', f'${_i}', 1)
+        SQL_PREPARE[_nome] = f'PREPARE {_nome} AS {_corpo}'
+        SQL_EXECUTE[_nome] = f"EXECUTE {_nome} ({', '.join(['%s'] * _total)})"
+
+# Abrir comanda e lançar item: transações pequenas e frequentes, em que perder os últimos
+# milissegundos numa queda do servidor é aceitável (o pagamento, que grava a venda, continua
+# síncrono). O COMMIT volta sem esperar o fsync do WAL; o SET LOCAL vai no mesmo envio do
+# statement e vale só para a transação corrente.
+COMMIT_ASSINCRONO = ('abre_comanda', 'upsert_item_comanda')
+
+if IS_POSTGRES:
+    for _nome in COMMIT_ASSINCRONO:
+        SQL[_nome] = 'SET LOCAL synchronous_commit = off; ' + SQL[_nome]
+        SQL_EXECUTE[_nome] = 'SET LOCAL synchronous_commit = off; ' + SQL_EXECUTE[_nome]
+
+class ConexaoPostgres(ConexaoPsycopg):
+    """Conexão psycopg2 que guarda quais statements de SQL_PREPARE foram preparados nela."""
+    preparados = None  # None = ainda não tentou preparar
+
+def preparar_conexao(db):
+    """Prepara os statements na conexão recém-aberta (fora de qualquer transação da requisição).
+    Cada PREPARE roda no seu próprio savepoint: um que falhe (ex.: tabela ainda inexistente num
+    banco antigo ou antes do /init_db) não derruba os outros, e a consulta dele segue sem preparo."""
+    preparados = set()
+    with db.cursor() as cursor:
+        for nome, comando in SQL_PREPARE.items():
+            cursor.execute('SAVEPOINT preparo')
+            try:
+                cursor.execute(comando)
+            except psycopg2.Error:
+                cursor.execute('ROLLBACK TO SAVEPOINT preparo')
+            else:
+                cursor.execute('RELEASE SAVEPOINT preparo')
+                preparados.add(nome)
+    db.commit()
+    db.preparados = frozenset(preparados)
+
+def sql_conexao(db, nome):
+    """Texto de SQL[nome] para esta conexão: o EXECUTE do statement preparado, se ele existir nela."""
+    if nome in (getattr(db, 'preparados', None) or ()):
+        return SQL_EXECUTE[nome]
+    return SQL[nome]
+
 # ========================================
 # FUNÇÕES DE CONEXÃO COM O BANCO DE DADOS
 # ========================================
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    """Cria o pool de conexões na primeira requisição (e não no import, para não criar o arquivo SQLite antes do init_db)
+    e, junto, migra o banco se ele vier de uma versão anterior do schema (ver migrar_schema)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if IS_POSTGRES:
+                    # Produção: PostgreSQL
+                    database_url = os.environ['DATABASE_URL']
+                    if database_url.startswith('postgres://'):
+                        database_url = database_url.replace('postgres://', 'postgresql://', 1)
+
+                    # Para PostgreSQL, usamos cursor_factory em vez de row_factory
+                    pool = ThreadedConnectionPool(
+                        1, DB_POOL_SIZE, database_url,
+                        connection_factory=ConexaoPostgres, cursor_factory=RealDictCursor
+                    )
+                    db = pool.getconn()
+                    migrar_schema(db)
+                    pool.putconn(db)
+                else:
+                    # Desenvolvimento: SQLite (pilha LIFO mantém a conexão com o cache mais "quente" no topo)
+                    pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+                    if not sqlite_sem_schema():
+                        db = _connect_sqlite()
+                        migrar_schema(db)
+                        pool.put_nowait(db)
+                # Publica o pool só depois da migração: as outras threads esperam no lock
+                _pool = pool
+    return _pool
+
+def _connect_sqlite():
+    db = sqlite3.connect(DATABASE, check_same_thread=False, cached_statements=256)
+    db.row_factory = sqlite3.Row
+    db.executescript(SQLITE_PRAGMAS)
+    return db
+
 def get_db_connection():
-    """Retorna conexão com o banco de dados (SQLite local ou PostgreSQL no Render)"""
+    """Retorna conexão com o banco de dados (SQLite local ou PostgreSQL no Render), emprestada do pool"""
     db = getattr(g, '_database', None)
     if db is None:
-        database_url = os.environ.get('DATABASE_URL')
-        
-        if database_url:
-            # Produção: PostgreSQL
-            if database_url.startswith('postgres://'):
-                database_url = database_url.replace('postgres://', 'postgresql://', 1)
-            
-            # Para PostgreSQL, usamos cursor_factory em vez de row_factory
-            db = g._database = psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+        pool = _get_pool()
+
+        if isinstance(pool, ThreadedConnectionPool):
+            db = g._database = pool.getconn()
+            if db.preparados is None:
+                preparar_conexao(db)
         else:
-            # Desenvolvimento: SQLite
-            db = g._database = sqlite3.connect(DATABASE)
-            db.row_factory = sqlite3.Row
+            try:
+                db = g._database = pool.get_nowait()
+            except queue.Empty:
+                db = g._database = _connect_sqlite()
     
     return db
 
+def fetchall_dicts(cursor):
+    """Retorna as linhas já como dicionários, sem conversão linha a linha duplicada.
+
+    O RealDictCursor (PostgreSQL) já entrega dicts; no SQLite os nomes das colunas são
+    lidos uma única vez do cursor.description e combinados com cada tupla.
+    """
+    return linhas_como_dicts(cursor, cursor.fetchall())
+
+def linhas_como_dicts(cursor, rows):
+    """Converte um lote de linhas já lido do cursor (no PostgreSQL elas já são dicts)."""
+    if IS_POSTGRES:
+        return rows
+    cols = [col[0] for col in cursor.description]
+    return [dict(zip(cols, row)) for row in rows]
+
+def cursor_tuplas(db):
+    """Cursor que devolve tuplas simples: evita montar um RealDictRow/sqlite3.Row por linha quando
+    quem lê já conhece as colunas (ver linhas_por_colunas)."""
+    if IS_POSTGRES:
+        return db.cursor(cursor_factory=CursorPsycopg)
+    cursor = db.cursor()
+    cursor.row_factory = None
+    return cursor
+
+def linhas_por_colunas(cursor, colunas):
+    """Lista de dicts a partir de um cursor_tuplas, com as chaves da tupla de colunas do módulo."""
+    return [dict(zip(colunas, row)) for row in cursor.fetchall()]
+
+# Linhas por lote nas listagens enviadas em stream
+LOTE_STREAM = 500
+
+def cursor_em_lotes(db, nome):
+    """Cursor para listagens que crescem com o histórico. No PostgreSQL é um cursor de servidor
+    (named cursor): o execute() não traz o resultado inteiro, só LOTE_STREAM linhas por vez."""
+    if IS_POSTGRES:
+        cursor = db.cursor(name=nome)
+        cursor.itersize = LOTE_STREAM
+        return cursor
+    return db.cursor()
+
+def resposta_lista_em_stream(cursor, inicio='[', fim=']\n'):
+    """Envia o resultado do cursor como uma lista JSON gerada lote a lote: a memória fica
+    limitada a LOTE_STREAM linhas, independente do tamanho da tabela. `inicio`/`fim` permitem
+    embrulhar a lista num objeto (ex.: '{"total":3,"usuarios":[' ... ']}')."""
+    def gerar():
+        yield inicio
+        separador = ''
+        while True:
+            lote = cursor.fetchmany(LOTE_STREAM)
+            if not lote:
+                break
+            # Serializa o lote inteiro de uma vez (em C) e remove os colchetes da lista
+            yield separador + app.json.dumps(linhas_como_dicts(cursor, lote))[1:-1]
+            separador = ','
+        yield fim
+
+    return app.response_class(stream_with_context(gerar()), mimetype='application/json')
+
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+    """Devolve a conexão ao pool, descartando transações pendentes (ou a própria conexão, se estiver quebrada)."""
+    db = g.pop('_database', None)
+    if db is None:
+        return
+
+    pool = _get_pool()
+    if isinstance(pool, ThreadedConnectionPool):
+        try:
+            db.rollback()
+            pool.putconn(db)
+        except psycopg2.Error:
+            pool.putconn(db, close=True)
+    else:
+        try:
+            db.rollback()
+            otimizar_sqlite_periodicamente(db)
+            pool.put_nowait(db)
+        except (sqlite3.Error, queue.Full):
+            fechar_sqlite(db)
+
+# O PRAGMA optimize (atualiza as estatísticas do planejador quando compensa) não precisa rodar a
+# cada requisição: no máximo uma vez por intervalo em cada processo e ao fechar uma conexão
+SQLITE_OPTIMIZE_INTERVALO = float(os.environ.get('SQLITE_OPTIMIZE_INTERVALO', 3600))
+_proximo_optimize = time.monotonic() + SQLITE_OPTIMIZE_INTERVALO
+
+def otimizar_sqlite_periodicamente(db):
+    """Roda o PRAGMA optimize na conexão devolvida ao pool se o intervalo já passou."""
+    global _proximo_optimize
+    if time.monotonic() >= _proximo_optimize:
+        _proximo_optimize = time.monotonic() + SQLITE_OPTIMIZE_INTERVALO
+        db.execute('PRAGMA optimize')
+
+def fechar_sqlite(db):
+    """Fecha uma conexão que sai do pool, rodando antes o PRAGMA optimize (se ela ainda responder)."""
+    try:
+        db.execute('PRAGMA optimize')
+    except sqlite3.Error:
+        pass
+    db.close()
+
+# ========================================
+# CACHE DE LEITURA DOS CATÁLOGOS (INSUMOS/PRODUTOS/FICHAS)
+# ========================================
+# Listas que só mudam quando alguém cadastra/edita e que o PDV consulta o tempo todo: a resposta
+# serializada fica em memória até a próxima escrita (versão) ou até o TTL, que limita a defasagem
+# entre workers do Gunicorn (a versão é de cada processo). Mesas e comandas abertas mudam a cada
+# atendimento e não entram no cache: saem sempre do banco, só com ETag (resposta_condicional).
+# As fichas ficam uma por produto: o cache guarda no máximo CATALOGO_CACHE_MAX respostas,
+# descartando as usadas há mais tempo.
+CATALOGO_CACHE_TTL = float(os.environ.get('CATALOGO_CACHE_TTL', 5))
+CATALOGO_CACHE_MAX = int(os.environ.get('CATALOGO_CACHE_MAX', 1024))
+_catalogo_cache = OrderedDict()  # chave -> (versao, expira_em, corpo, etag), da menos à mais usada
+_catalogo_lock = threading.Lock()
+_catalogo_versao = defaultdict(int)
+
+def invalidar_catalogo(nome):
+    """Descarta a resposta em cache do catálogo após uma escrita."""
+    _catalogo_versao[nome] += 1
+
+def resposta_catalogo(nome, carregar, chave=None):
+    """Devolve o catálogo do cache (ou recarrega via `carregar()`), com ETag e suporte a 304.
+    `chave` separa várias respostas do mesmo catálogo (ex.: a ficha de cada produto), todas
+    descartadas juntas por invalidar_catalogo(nome)."""
+    chave = chave or nome
+    versao = _catalogo_versao[nome]
+    with _catalogo_lock:
+        entrada = _catalogo_cache.get(chave)
+        if entrada is not None:
+            _catalogo_cache.move_to_end(chave)
+
+    if entrada is None or entrada[0] != versao or entrada[1] < time.monotonic():
+        corpo = app.json.response(carregar()).get_data()
+        entrada = (versao, time.monotonic() + CATALOGO_CACHE_TTL, corpo, hashlib.md5(corpo).hexdigest())
+        with _catalogo_lock:
+            _catalogo_cache[chave] = entrada
+            _catalogo_cache.move_to_end(chave)
+            while len(_catalogo_cache) > CATALOGO_CACHE_MAX:
+                _catalogo_cache.popitem(last=False)
+
+    return _resposta_com_etag(entrada[2], entrada[3])
+
+def resposta_condicional(dados):
+    """Resposta JSON com ETag do próprio corpo e suporte a 304, sem guardar nada em cache."""
+    corpo = app.json.response(dados).get_data()
+    return _resposta_com_etag(corpo, hashlib.md5(corpo).hexdigest())
+
+def _resposta_com_etag(corpo, etag):
+    response = app.response_class(corpo, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+# ========================================
+# HASH DE SENHAS (BCRYPT)
+# ========================================
+# O bcrypt libera o GIL enquanto calcula o hash: um pool de threads do tamanho do número de CPUs
+# paraleliza logins/cadastros simultâneos (sem o pickling e o fork de um ProcessPool) e limita
+# quantos hashes disputam a CPU com as demais requisições do worker.
+_hash_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='bcrypt')
+
+# Custo do bcrypt, ajustável ao hardware do servidor (cada +1 dobra o tempo do hash). Hashes
+# gravados com outro custo são refeitos no próximo login correto (ver hash_desatualizado).
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+
+def gerar_hash_senha(password):
+    """Gera o hash bcrypt (com salt novo) da senha, em texto para salvar no banco."""
+    return _hash_pool.submit(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)).result().decode('utf-8')
+
+def hash_desatualizado(password_hash):
+    """True se o hash foi gerado com um custo diferente de BCRYPT_ROUNDS ("$2b$12$...")."""
+    return password_hash[4:6] != f'{BCRYPT_ROUNDS:02d}'
+
+# Hash de referência com o mesmo custo dos hashes reais: o login confere a senha contra ele quando
+# o usuário não existe, para que o tempo de resposta não revele quais nomes estão cadastrados.
+HASH_FICTICIO = bcrypt.hashpw(b'senha-ficticia', bcrypt.gensalt(BCRYPT_ROUNDS)).decode('utf-8')
+
+def verificar_senha(password, password_hash):
+    """Confere a senha contra o hash bcrypt armazenado."""
+    return _hash_pool.submit(bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8')).result()
+
+# Logins repetidos (integrações, o PDV reabrindo a sessão) pulam o bcrypt por LOGIN_CACHE_TTL
+# segundos. A chave é um HMAC da senha com o hash gravado, sob um segredo gerado a cada processo:
+# a senha não fica em memória e trocar a senha (hash novo) já invalida a entrada.
+LOGIN_CACHE_TTL = float(os.environ.get('LOGIN_CACHE_TTL', 60))
+LOGIN_CACHE_MAX = 1024
+_segredo_login = os.urandom(32)
+_logins_verificados = {}  # chave -> expira_em
+
+def verificar_senha_com_cache(password, password_hash):
+    """verificar_senha, lembrando por alguns segundos os pares senha/hash já conferidos com sucesso."""
+    chave = hmac.digest(_segredo_login, f'{password_hash}\0{password}'.encode('utf-8'), 'sha256')
+    if _logins_verificados.get(chave, 0) > time.monotonic():
+        return True
+
+    if not verificar_senha(password, password_hash):
+        return False
+    if len(_logins_verificados) >= LOGIN_CACHE_MAX:
+        _logins_verificados.clear()
+    _logins_verificados[chave] = time.monotonic() + LOGIN_CACHE_TTL
+    return True
+
+# ========================================
+# LEITURA E VALIDAÇÃO DO CORPO JSON
+# ========================================
+# Corpos das respostas de erro com mensagem fixa, serializados uma única vez por mensagem.
+# Só o corpo é reaproveitado: cada requisição ganha um Response novo, pois o CORS e o
+# Werkzeug alteram os headers do objeto devolvido.
+_corpos_erro = {}
+
+def erro_fixo(erro, status):
+    """Resposta de erro para mensagens constantes (nunca para textos montados com dados da requisição).
+    `erro` é a mensagem ou o corpo completo, se for dict."""
+    chave = erro if isinstance(erro, str) else tuple(erro.items())
+    corpo = _corpos_erro.get(chave)
+    if corpo is None:
+        corpo = _corpos_erro[chave] = app.json.response(erro if isinstance(erro, dict) else {'error': erro}).get_data()
+    return app.response_class(corpo, status=status, mimetype='application/json')
+
+def corpo_json(*obrigatorios, erro='Corpo da requisição inválido.', tipos=None):
+    """Decorator das rotas de escrita: lê o corpo JSON uma única vez, confere os campos obrigatórios
+    e entrega o dict como primeiro argumento do handler. `erro` é a mensagem (ou o corpo completo,
+    se for dict) da resposta 400 quando o corpo falta ou está incompleto. `tipos` mapeia campo ->
+    conversor (int, float): os campos presentes já chegam convertidos, e um valor inválido também
+    responde 400 com `erro`."""
+    conversoes = tuple((tipos or {}).items())
+
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict) or any(campo not in data for campo in obrigatorios):
+                return erro_fixo(erro, 400)
+            try:
+                for campo, conversor in conversoes:
+                    if campo in data:
+                        data[campo] = conversor(data[campo])
+            except (TypeError, ValueError):
+                return erro_fixo(erro, 400)
+            return handler(data, *args, **kwargs)
+        return wrapper
+    return decorator
 
 # =================================================================
 # FUNÇÃO CRÍTICA: INICIALIZAÇÃO DO DB
@@ -59,7 +663,6 @@ def init_db():
     """Inicializa o banco de dados com o schema, adaptado para PostgreSQL e SQLite."""
     with app.app_context():
         db = get_db_connection()
-        is_postgres = os.environ.get('DATABASE_URL') is not None
         
         with app.open_resource('schema.sql', mode='r') as f:
             sql_script = f.read()
@@ -67,12 +670,16 @@ def init_db():
         try:
             cursor = db.cursor()
             
-            if is_postgres:
-                # PostgreSQL usa cursor.execute() para executar o bloco inteiro
+            if IS_POSTGRES:
+                # PostgreSQL usa cursor.execute() para executar o bloco inteiro (uma ida ao servidor)
                 cursor.execute(sql_script)
             else:
-                # SQLite usa executescript() na conexão (db)
-                db.executescript(sql_script) 
+                # SQLite usa executescript() na conexão (db). Sozinho ele roda cada statement em
+                # autocommit: o BEGIN explícito faz o script inteiro valer ou ser desfeito no rollback
+                db.executescript('BEGIN;\n' + sql_script)
+
+            # Atualiza as estatísticas para o planejador passar a usar os índices recém-criados
+            cursor.execute('ANALYZE')
                 
             db.commit()
             return True
@@ -81,6 +688,127 @@ def init_db():
             db.rollback() 
             raise e 
 
+def sqlite_sem_schema():
+    """Indica se o banco SQLite local ainda precisa do schema: arquivo inexistente ou sem nenhuma tabela
+    (ex.: arquivo vazio deixado por uma inicialização que falhou). Uma única consulta ao catálogo."""
+    if not os.path.exists(DATABASE):
+        return True
+    with closing(sqlite3.connect(DATABASE)) as conn:
+        return conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0] == 0
+
+# =================================================================
+# MIGRAÇÃO DE BANCOS JÁ EM USO
+# =================================================================
+# O /init_db recria tudo do zero (DROP em todas as tabelas), então um banco criado por uma versão
+# anterior do schema.sql não ganha sozinho os índices novos. Cada passo abaixo roda só se o índice
+# ainda não existir, e já acerta os dados para ele: os itens repetidos das comandas são fundidos
+# antes do índice único. Onde acertar os dados seria decidir pelo operador (ver CONFLITOS_MIGRACAO),
+# o passo é pulado e os registros em conflito vão para o log. As definições são as mesmas do schema.sql.
+MIGRACOES = (
+    # Itens repetidos de um mesmo produto viram uma linha só (quantidade somada, preço médio
+    # ponderado: o total da comanda não muda) e ganham o índice único do ON CONFLICT do add_item
+    ('idx_comanda_itens_comanda_produto', (
+        '''
+        UPDATE comanda_itens SET
+            quantidade = (
+                SELECT SUM(d.quantidade) FROM comanda_itens d
+                WHERE d.comanda_id = comanda_itens.comanda_id AND d.produto_id = comanda_itens.produto_id
+            ),
+            preco_unitario = (
+                SELECT COALESCE(SUM(d.quantidade * d.preco_unitario) / NULLIF(SUM(d.quantidade), 0), comanda_itens.preco_unitario)
+                FROM comanda_itens d
+                WHERE d.comanda_id = comanda_itens.comanda_id AND d.produto_id = comanda_itens.produto_id
+            )
+        WHERE id IN (SELECT MIN(id) FROM comanda_itens GROUP BY comanda_id, produto_id HAVING COUNT(*) > 1)
+        ''',
+        'DELETE FROM comanda_itens WHERE id NOT IN (SELECT MIN(id) FROM comanda_itens GROUP BY comanda_id, produto_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_comanda_itens_comanda_produto ON comanda_itens (comanda_id, produto_id)',
+    )),
+    ('idx_usuarios_username_lower', (
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_usuarios_username_lower ON usuarios (LOWER(username))',
+    )),
+    ('idx_comandas_uma_aberta_por_mesa', (
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_comandas_uma_aberta_por_mesa ON comandas (mesa_id) WHERE status = 'aberta'",
+    )),
+    ('idx_ficha_itens_cobertura', (
+        'CREATE INDEX IF NOT EXISTS idx_ficha_itens_cobertura ON ficha_itens (ficha_id, insumo_id, quantidade_necessaria)',
+    )),
+    ('idx_ficha_itens_insumo', (
+        'CREATE INDEX IF NOT EXISTS idx_ficha_itens_insumo ON ficha_itens (insumo_id)',
+    )),
+    ('idx_comandas_mesa_status', (
+        'CREATE INDEX IF NOT EXISTS idx_comandas_mesa_status ON comandas (mesa_id, status)',
+    )),
+    ('idx_comandas_status_abertura', (
+        'CREATE INDEX IF NOT EXISTS idx_comandas_status_abertura ON comandas (status, data_abertura)',
+    )),
+    ('idx_insumos_estoque_baixo', (
+        'CREATE INDEX IF NOT EXISTS idx_insumos_estoque_baixo ON insumos (nome) WHERE quantidade_estoque <= estoque_minimo',
+    )),
+)
+
+# Passos que dependem de alguém decidir o que fazer com os dados (quais contas renomear, por
+# exemplo): se a consulta devolver linhas, o passo não roda e elas vão para o log. O índice é
+# criado no primeiro início do app depois que o conflito for resolvido no banco.
+CONFLITOS_MIGRACAO = {
+    'idx_usuarios_username_lower': (
+        'usuários com o mesmo nome, ignorando maiúsculas/minúsculas (id, username)',
+        '''
+        SELECT id, username FROM usuarios
+        WHERE LOWER(username) IN (SELECT LOWER(username) FROM usuarios GROUP BY LOWER(username) HAVING COUNT(*) > 1)
+        ORDER BY LOWER(username), id
+        ''',
+    ),
+    'idx_comandas_uma_aberta_por_mesa': (
+        'mesas com mais de uma comanda aberta (mesa_id, comanda_id)',
+        '''
+        SELECT mesa_id, id FROM comandas
+        WHERE status = 'aberta'
+        AND mesa_id IN (SELECT mesa_id FROM comandas WHERE status = 'aberta' GROUP BY mesa_id HAVING COUNT(*) > 1)
+        ORDER BY mesa_id, id
+        ''',
+    ),
+}
+
+def conflitos_migracao(db, objeto):
+    """Registra no log os dados que impedem o passo `objeto` de MIGRACOES; True se houver algum."""
+    if objeto not in CONFLITOS_MIGRACAO:
+        return False
+    descricao, consulta = CONFLITOS_MIGRACAO[objeto]
+    cursor = cursor_tuplas(db)
+    cursor.execute(consulta)
+    linhas = cursor.fetchall()
+    if linhas:
+        app.logger.error('Migração: %s não foi criado; há %s: %s. Corrija os dados no banco e reinicie o app.',
+                         objeto, descricao, ', '.join(str(tuple(linha)) for linha in linhas))
+    return bool(linhas)
+
+# Chave do advisory lock do PostgreSQL que serializa a migração entre os workers que sobem juntos
+TRAVA_MIGRACAO = 75895
+
+def migrar_schema(db):
+    """Aplica os passos de MIGRACOES que faltarem no banco, numa única transação. Roda uma vez
+    por processo, na criação do pool; num banco ainda sem tabelas (antes do /init_db) não faz nada.
+    Uma falha é registrada no log e desfeita, sem impedir o app de subir."""
+    cursor = db.cursor()
+    try:
+        if IS_POSTGRES:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', (TRAVA_MIGRACAO,))
+        else:
+            cursor.execute('BEGIN IMMEDIATE')
+
+        cursor.execute(SQL['existe_objeto'], ('vendas',))
+        if cursor.fetchone() is not None:
+            for objeto, comandos in MIGRACOES:
+                cursor.execute(SQL['existe_objeto'], (objeto,))
+                if cursor.fetchone() is None and not conflitos_migracao(db, objeto):
+                    for comando in comandos:
+                        cursor.execute(comando)
+        db.commit()
+    except Exception:
+        db.rollback()
+        app.logger.exception('Erro ao migrar o schema do banco')
+
 @app.route('/init_db')
 def initialize_db_route():
     try:
@@ -94,17 +822,10 @@ def initialize_db_route():
 # ========================================
 
 @app.route('/login', methods=['POST'])
-def login():
+@corpo_json('username', 'password', erro={'success': False, 'message': 'Nome de usuário e senha são obrigatórios.'})
+def login(data):
     """Rota para autenticação de usuários"""
     try:
-        data = request.get_json()
-        
-        if not data or 'username' not in data or 'password' not in data:
-            return jsonify({
-                'success': False,
-                'message': 'Nome de usuário e senha são obrigatórios.'
-            }), 400
-        
         username = data['username'].strip()
         password = data['password']
         
@@ -116,29 +837,22 @@ def login():
         
         db = get_db_connection()
         cursor = db.cursor()
-        cursor.execute(
-            "SELECT id, username, password_hash FROM usuarios WHERE username = %s" if os.environ.get('DATABASE_URL') else "SELECT id, username, password_hash FROM usuarios WHERE username = ?",
-            (username,)
-        )
+        cursor.execute(sql_conexao(db, 'sel_usuario_login'), (username,))
         usuario = cursor.fetchone()
         
         if not usuario:
+            verificar_senha(password, HASH_FICTICIO)
             return jsonify({
                 'success': False,
                 'message': 'Usuário ou senha incorretos.'
             }), 401
         
-        # Converte para dict se for necessário (RealDictCursor já retorna dict)
-        if hasattr(usuario, '_asdict'):
-            usuario = dict(usuario)
-        elif not isinstance(usuario, dict) and hasattr(usuario, 'keys'):
-            usuario = dict(usuario)
-
-        
-        password_hash_armazenado = usuario['password_hash'].encode('utf-8')
-        password_fornecida = password.encode('utf-8')
-        
-        if bcrypt.checkpw(password_fornecida, password_hash_armazenado):
+        # RealDictRow e sqlite3.Row: os dois aceitam acesso pelo nome da coluna
+        if verificar_senha_com_cache(password, usuario['password_hash']):
+            # Custo do bcrypt mudou desde o cadastro: regrava o hash com o custo atual
+            if hash_desatualizado(usuario['password_hash']):
+                cursor.execute(SQL['upd_senha_usuario'], (gerar_hash_senha(password), usuario['id']))
+                db.commit()
             return jsonify({
                 'success': True,
                 'message': 'Login realizado com sucesso!',
@@ -165,46 +879,20 @@ def verificar_usuarios():
     try:
         db = get_db_connection()
         cursor = db.cursor()
-        cursor.execute("SELECT COUNT(*) as total FROM usuarios")
-        resultado = cursor.fetchone()
+        cursor.execute(SQL['conta_usuarios'])
+        total_usuarios = cursor.fetchone()['total']
         
-        if isinstance(resultado, dict) or (resultado and hasattr(resultado, 'keys')):
-            total_usuarios = resultado['total']
-        else:
-            total_usuarios = resultado[0] if resultado else 0
-        
-        cursor.execute("SELECT id, username, data_criacao FROM usuarios")
-        usuarios = cursor.fetchall()
-        
-        usuarios_list = []
-        for u in usuarios:
-            if hasattr(u, '_asdict'):
-                usuarios_list.append(dict(u))
-            elif hasattr(u, 'keys'):
-                usuarios_list.append(dict(u))
-            else:
-                usuarios_list.append(u)
-
-        return jsonify({
-            'total': total_usuarios,
-            'usuarios': usuarios_list
-        }), 200
+        cursor.execute(SQL['sel_usuarios'])
+        return resposta_lista_em_stream(cursor, inicio=f'{{"total":{total_usuarios},"usuarios":[', fim=']}\n'), 200
     
     except Exception as e:
         return jsonify({'error': f'Erro ao verificar usuários: {str(e)}'}), 500
         
 @app.route('/cadastrar', methods=['POST'])
-def cadastrar_usuario():
+@corpo_json('username', 'password', erro={'success': False, 'message': 'Nome de usuário e senha são obrigatórios.'})
+def cadastrar_usuario(data):
     """Rota para cadastrar novos usuários"""
     try:
-        data = request.get_json()
-        
-        if not data or 'username' not in data or 'password' not in data:
-            return jsonify({
-                'success': False,
-                'message': 'Nome de usuário e senha são obrigatórios.'
-            }), 400
-        
         username = data['username'].strip()
         password = data['password']
         
@@ -226,32 +914,24 @@ def cadastrar_usuario():
                 'message': 'A senha deve ter pelo menos 4 caracteres.'
             }), 400
         
-        # Verifica se o usuário já existe
+        # Cria o hash da senha antes de tocar no banco: o tempo de resposta é o mesmo
+        # para nomes livres e já cadastrados
+        hashed_password_str = gerar_hash_senha(password)
+        
+        # Insere o novo usuário; se o nome já existir (índice único em LOWER(username)),
+        # o INSERT não faz nada e não devolve linha — sem janela entre verificar e inserir
         db = get_db_connection()
         cursor = db.cursor()
+        cursor.execute(SQL['ins_usuario'], (username, hashed_password_str))
+        usuario_novo = cursor.fetchone()
+        db.commit()
         
-        is_postgres = os.environ.get('DATABASE_URL') is not None
-        query_check = "SELECT id FROM usuarios WHERE username = %s" if is_postgres else "SELECT id FROM usuarios WHERE username = ?"
-        cursor.execute(query_check, (username,))
-        usuario_existente = cursor.fetchone()
-        
-        if usuario_existente:
+        if not usuario_novo:
             return jsonify({
                 'success': False,
                 'message': f'O usuário "{username}" já existe. Escolha outro nome.'
             }), 400
         
-        # Cria o hash da senha
-        password_bytes = password.encode('utf-8')
-        salt = bcrypt.gensalt()
-        hashed_password = bcrypt.hashpw(password_bytes, salt)
-        hashed_password_str = hashed_password.decode('utf-8')
-        
-        # Insere o novo usuário
-        query_insert = "INSERT INTO usuarios (username, password_hash) VALUES (%s, %s)" if is_postgres else "INSERT INTO usuarios (username, password_hash) VALUES (?, ?)"
-        cursor.execute(query_insert, (username, hashed_password_str))
-        db.commit()
-        
         return jsonify({
             'success': True,
             'message': f'Usuário "{username}" cadastrado com sucesso!'
@@ -273,51 +953,31 @@ def list_mesas():
     try:
         status_filter = request.args.get('status')
         db = get_db_connection()
-        cursor = db.cursor()
-        is_postgres = os.environ.get('DATABASE_URL') is not None
-        
-        query = 'SELECT id, numero, capacidade, localizacao, status FROM mesas'
-        params = ()
+        cursor = cursor_tuplas(db)
         
         if status_filter:
-            query += ' WHERE status = %s' if is_postgres else ' WHERE status = ?'
-            params = (status_filter,)
-            
-        query += ' ORDER BY numero'
-        
-        cursor.execute(query, params)
-        mesas = cursor.fetchall()
+            cursor.execute(SQL['sel_mesas_por_status'], (status_filter,))
+        else:
+            cursor.execute(SQL['sel_mesas'])
         
-        return jsonify([dict(m) for m in mesas]), 200
+        return resposta_condicional(linhas_por_colunas(cursor, COLUNAS_MESA))
     except Exception as e:
         return jsonify({'error': f'Erro ao listar mesas: {str(e)}'}), 500
 
 @app.route('/api/mesas', methods=['POST'])
-def add_mesa():
+@corpo_json('numero', 'capacidade', erro='Número e capacidade são obrigatórios')
+def add_mesa(data):
     """Adiciona uma nova mesa."""
     try:
-        data = request.get_json()
-        if not data or 'numero' not in data or 'capacidade' not in data:
-            return jsonify({'error': 'Número e capacidade são obrigatórios'}), 400
-            
         numero = int(data['numero'])
         capacidade = int(data['capacidade'])
         localizacao = data.get('localizacao', '').strip()
         
         db = get_db_connection()
         cursor = db.cursor()
-        is_postgres = os.environ.get('DATABASE_URL') is not None
-        
-        query = 'INSERT INTO mesas (numero, capacidade, localizacao) VALUES (%s, %s, %s) RETURNING id, numero, capacidade, localizacao, status' if is_postgres else 'INSERT INTO mesas (numero, capacidade, localizacao) VALUES (?, ?, ?)'
-        
-        cursor.execute(query, (numero, capacidade, localizacao))
-        
-        if is_postgres:
-            mesa_nova = dict(cursor.fetchone())
-        else:
-            mesa_id = cursor.lastrowid
-            cursor.execute('SELECT id, numero, capacidade, localizacao, status FROM mesas WHERE id = ?', (mesa_id,))
-            mesa_nova = dict(cursor.fetchone())
+        # RETURNING (PostgreSQL e SQLite >= 3.35) devolve a linha com o status default do banco
+        cursor.execute(SQL['ins_mesa'], (numero, capacidade, localizacao))
+        mesa_nova = dict(cursor.fetchone())
             
         db.commit()
         return jsonify(mesa_nova), 201
@@ -325,31 +985,27 @@ def add_mesa():
     except Exception as e:
         # Tenta pegar a mensagem de erro do Postgres para o erro de chave duplicada
         if 'duplicate key value violates unique constraint "mesas_numero_key"' in str(e):
-             return jsonify({'error': 'Já existe uma mesa com este número.'}), 409
+             return erro_fixo('Já existe uma mesa com este número.', 409)
         
         return jsonify({'error': f'Erro ao adicionar mesa: {str(e)}'}), 500
 
 @app.route('/api/mesas/<int:mesa_id>', methods=['PUT'])
-def update_mesa(mesa_id):
+@corpo_json(erro='Status inválido. Deve ser disponivel, ocupada, reservada ou suja.')
+def update_mesa(data, mesa_id):
     """Atualiza o status de uma mesa."""
     try:
-        data = request.get_json()
         status = data.get('status')
         
         if not status or status not in ['disponivel', 'ocupada', 'reservada', 'suja']: # Adicionado 'suja'
-            return jsonify({'error': 'Status inválido. Deve ser disponivel, ocupada, reservada ou suja.'}), 400
+            return erro_fixo('Status inválido. Deve ser disponivel, ocupada, reservada ou suja.', 400)
         
         db = get_db_connection()
         cursor = db.cursor()
-        is_postgres = os.environ.get('DATABASE_URL') is not None
-        
-        query = 'UPDATE mesas SET status = %s WHERE id = %s' if is_postgres else 'UPDATE mesas SET status = ? WHERE id = ?'
-        
-        cursor.execute(query, (status, mesa_id))
+        cursor.execute(sql_conexao(db, 'upd_mesa_status'), (status, mesa_id))
         db.commit()
         
         if cursor.rowcount == 0:
-            return jsonify({'error': 'Mesa não encontrada.'}), 404
+            return erro_fixo('Mesa não encontrada.', 404)
             
         return jsonify({'message': f'Status da Mesa {mesa_id} atualizado para {status}'}), 200
         
@@ -361,45 +1017,37 @@ def update_mesa(mesa_id):
 # ========================================
 
 @app.route('/api/comandas', methods=['POST'])
-def abrir_comanda():
+@corpo_json('mesa_id', erro='ID da mesa é obrigatório para abrir uma comanda.', tipos={'mesa_id': int})
+def abrir_comanda(data):
     """Abre uma nova comanda para uma mesa e muda o status da mesa para 'ocupada'."""
     try:
-        data = request.get_json()
-        
-        if not data or 'mesa_id' not in data:
-            return jsonify({'error': 'ID da mesa é obrigatório para abrir uma comanda.'}), 400
-            
-        mesa_id = int(data['mesa_id'])
+        mesa_id = data['mesa_id']
         
         db = get_db_connection()
         cursor = db.cursor()
-        is_postgres = os.environ.get('DATABASE_URL') is not None
-        
-        # 1. Verificar se a mesa existe e está disponível
-        query_mesa_check = "SELECT id, status FROM mesas WHERE id = %s" if is_postgres else "SELECT id, status FROM mesas WHERE id = ?"
-        cursor.execute(query_mesa_check, (mesa_id,))
-        mesa = cursor.fetchone()
         
-        if not mesa:
-            return jsonify({'error': f'Mesa ID {mesa_id} não encontrada.'}), 404
-            
-        mesa_status = dict(mesa).get('status')
-        if mesa_status != 'disponivel':
-            return jsonify({'error': f'Mesa {mesa_id} não está disponível (Status: {mesa_status}).'}), 409
-
-        # 2. Inserir a nova comanda
-        query_insert_comanda = 'INSERT INTO comandas (mesa_id) VALUES (%s) RETURNING id' if is_postgres else 'INSERT INTO comandas (mesa_id) VALUES (?)'
-        cursor.execute(query_insert_comanda, (mesa_id,))
-        
-        if is_postgres:
-            comanda_id = dict(cursor.fetchone()).get('id')
+        # 1. Ocupar a mesa (só se estiver disponível) e 2. inserir a nova comanda
+        if IS_POSTGRES:
+            cursor.execute(sql_conexao(db, 'abre_comanda'), (mesa_id,))
+            comanda = cursor.fetchone()
         else:
-            comanda_id = cursor.lastrowid
+            comanda = None
+            cursor.execute(SQL['ocupa_mesa'], (mesa_id,))
+            if cursor.fetchone():
+                cursor.execute(SQL['ins_comanda'], (mesa_id,))
+                comanda = cursor.fetchone()
+        
+        if not comanda:
+            # Nada foi gravado: só agora lê a mesa, para explicar o motivo
+            db.rollback()
+            cursor.execute(SQL['sel_mesa_status'], (mesa_id,))
+            mesa = cursor.fetchone()
             
-        # 3. Atualizar o status da mesa para 'ocupada'
-        query_update_mesa = "UPDATE mesas SET status = %s WHERE id = %s" if is_postgres else "UPDATE mesas SET status = ? WHERE id = ?"
-        cursor.execute(query_update_mesa, ('ocupada', mesa_id))
-        
+            if not mesa:
+                return jsonify({'error': f'Mesa ID {mesa_id} não encontrada.'}), 404
+            return jsonify({'error': f'Mesa {mesa_id} não está disponível (Status: {mesa["status"]}).'}), 409
+
+        comanda_id = comanda['id']
         db.commit()
         return jsonify({
             'message': f'Comanda {comanda_id} aberta com sucesso para a Mesa {mesa_id}.',
@@ -410,6 +1058,9 @@ def abrir_comanda():
 
     except Exception as e:
         db.rollback()
+        # A mesa estava 'disponivel' mas já tinha uma comanda aberta (índice único parcial)
+        if 'idx_comandas_uma_aberta_por_mesa' in str(e) or 'UNIQUE constraint failed: comandas.mesa_id' in str(e):
+            return erro_fixo('Esta mesa já possui uma comanda aberta.', 409)
         return jsonify({'error': f'Erro ao abrir comanda: {str(e)}'}), 500
 
 
@@ -419,102 +1070,78 @@ def list_comandas():
     try:
         status_filter = request.args.get('status')
         db = get_db_connection()
-        cursor = db.cursor()
-        is_postgres = os.environ.get('DATABASE_URL') is not None
-        
-        # Query para calcular o total usando preco_unitario da comanda_itens (CORREÇÃO)
-        query = '''
-            SELECT 
-                c.id, c.data_abertura, c.data_fechamento, c.status,
-                m.numero as numero_mesa, m.id as mesa_id,
-                COALESCE(SUM(ci.quantidade * ci.preco_unitario), 0.0) as valor_total
-            FROM comandas c
-            JOIN mesas m ON c.mesa_id = m.id
-            LEFT JOIN comanda_itens ci ON c.id = ci.comanda_id
-            -- LEFT JOIN produtos p ON ci.produto_id = p.id -- Não precisamos mais do p.preco_venda aqui
-        '''
-        params = ()
+
+        # As comandas abertas (poucas, consultadas a todo momento pelo PDV) levam ETag:
+        # o PDV recebe 304 enquanto nada mudou
+        if status_filter == 'aberta':
+            cursor = db.cursor()
+            cursor.execute(SQL['sel_comandas_por_status'], ('aberta',))
+            return resposta_condicional(fetchall_dicts(cursor))
+
+        cursor = cursor_em_lotes(db, 'lista_comandas')
         
         if status_filter:
-            query += ' WHERE c.status = %s' if is_postgres else ' WHERE c.status = ?'
-            params = (status_filter,)
-            
-        query += ' GROUP BY c.id, m.id, m.numero, c.data_abertura, c.data_fechamento, c.status ORDER BY c.data_abertura DESC'
+            cursor.execute(SQL['sel_comandas_por_status'], (status_filter,))
+        else:
+            cursor.execute(SQL['sel_comandas'])
+        # Histórico cresce sem limite: envia em lotes (valor_total já vem como float dos dois bancos)
+        return resposta_lista_em_stream(cursor), 200
         
-        cursor.execute(query, params)
-        comandas = cursor.fetchall()
+    except Exception as e:
+        return jsonify({'error': f'Erro ao listar comandas: {str(e)}'}), 500
+
+
+@app.route('/api/comandas/<int:comanda_id>', methods=['GET'])
+def get_comanda_detalhes(comanda_id):
+    """Retorna a comanda com a mesa, o total e a lista de itens, em uma única ida ao banco."""
+    try:
+        db = get_db_connection()
+        cursor = db.cursor()
+        cursor.execute(SQL['sel_comanda_detalhes'], (comanda_id,))
+        comanda = cursor.fetchone()
         
-        comandas_list = []
-        for comanda in comandas:
-            comanda_dict = dict(comanda)
-            # Garante que o valor total seja float
-            comanda_dict['valor_total'] = float(comanda_dict['valor_total'])
-            comandas_list.append(comanda_dict)
-            
-        return jsonify(comandas_list), 200
+        if not comanda:
+            return jsonify({'error': f'Comanda ID {comanda_id} não encontrada.'}), 404
+        
+        # PostgreSQL já devolve um dict com o json_agg como lista: a linha vai direto para a resposta.
+        # No SQLite a linha é um sqlite3.Row e o json_group_array vem como texto.
+        if not IS_POSTGRES:
+            comanda = dict(comanda)
+            comanda['itens'] = app.json.loads(comanda['itens'])
+        
+        return jsonify(comanda), 200
         
     except Exception as e:
-        return jsonify({'error': f'Erro ao listar comandas: {str(e)}'}), 500
+        return jsonify({'error': f'Erro ao buscar comanda: {str(e)}'}), 500
 
 
 # Rota para adicionar itens a uma comanda (CORRIGIDA)
 @app.route('/api/comandas/<int:comanda_id>/itens', methods=['POST'])
-def add_item_comanda(comanda_id):
+@corpo_json('produto_id', erro='Produto ID e quantidade válida são obrigatórios.', tipos={'produto_id': int, 'quantidade': int})
+def add_item_comanda(data, comanda_id):
     """Adiciona um item a uma comanda existente, fixando o preco_unitario na comanda_itens."""
-    data = request.get_json()
     produto_id = data.get('produto_id')
-    quantidade = int(data.get('quantidade', 1))
+    quantidade = data.get('quantidade', 1)
 
     if not produto_id or quantidade <= 0:
-        return jsonify({'error': 'Produto ID e quantidade válida são obrigatórios.'}), 400
+        return erro_fixo('Produto ID e quantidade válida são obrigatórios.', 400)
 
     db = get_db_connection()
     cursor = db.cursor()
-    is_postgres = os.environ.get('DATABASE_URL') is not None
     
     try:
-        # 1. Verificar se a comanda está aberta e OBTEM o preço de venda do produto
-        query_data = '''
-            SELECT c.status, p.preco_venda 
-            FROM comandas c, produtos p 
-            WHERE c.id = %s AND p.id = %s
-        ''' if is_postgres else '''
-            SELECT c.status, p.preco_venda 
-            FROM comandas c, produtos p 
-            WHERE c.id = ? AND p.id = ?
-        '''
-        cursor.execute(query_data, (comanda_id, produto_id))
-        result = cursor.fetchone()
-        
-        if not result:
-            return jsonify({'error': 'Comanda ou Produto não encontrado.'}), 404
-        
-        result_dict = dict(result)
-        preco_unitario = float(result_dict['preco_venda'])
-        
-        if result_dict['status'] != 'aberta':
-            return jsonify({'error': 'Comanda não está aberta.'}), 409
-
-        # 2. Inserir/Atualizar o item na comanda_itens (incluindo o preco_unitario)
-        if is_postgres:
-            # PostgreSQL: Tenta inserir. Se a combinação (comanda_id, produto_id) 
-            # já existir, atualiza APENAS a quantidade (mantém o preco_unitario original)
-            query_insert = '''
-                INSERT INTO comanda_itens (comanda_id, produto_id, quantidade, preco_unitario) 
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (comanda_id, produto_id) 
-                DO UPDATE SET quantidade = comanda_itens.quantidade + EXCLUDED.quantidade 
-                RETURNING id
-            '''
-            cursor.execute(query_insert, (comanda_id, produto_id, quantidade, preco_unitario))
-        else:
-            # SQLite: Tenta atualizar, se falhar, insere
-            query_update = "UPDATE comanda_itens SET quantidade = quantidade + ? WHERE comanda_id = ? AND produto_id = ?"
-            cursor.execute(query_update, (quantidade, comanda_id, produto_id))
+        # 1. Inserir/Atualizar o item na comanda_itens (preco_unitario fixado pelo preço atual do produto)
+        cursor.execute(sql_conexao(db, 'upsert_item_comanda'), (quantidade, comanda_id, produto_id))
+        
+        if not cursor.fetchone():
+            # 2. Nada foi gravado: só agora lê comanda e produto, para explicar o motivo
+            db.rollback()
+            cursor.execute(SQL['sel_status_preco'], (comanda_id, produto_id))
+            result = cursor.fetchone()
             
-            if cursor.rowcount == 0:
-                query_insert = "INSERT INTO comanda_itens (comanda_id, produto_id, quantidade, preco_unitario) VALUES (?, ?, ?, ?)"
-                cursor.execute(query_insert, (comanda_id, produto_id, quantidade, preco_unitario))
+            if not result:
+                return erro_fixo('Comanda ou Produto não encontrado.', 404)
+            return erro_fixo('Comanda não está aberta.', 409)
 
         db.commit()
         return jsonify({'message': f'Item ID {produto_id} adicionado à comanda {comanda_id} (x{quantidade})'}), 201
@@ -526,70 +1153,81 @@ def add_item_comanda(comanda_id):
 
 # ROTA CRÍTICA: FECHAMENTO E PAGAMENTO DE COMANDA (NOVA)
 @app.route('/api/comandas/<int:comanda_id>/pagar', methods=['POST'])
-def registrar_pagamento_comanda(comanda_id):
-    """Fecha uma comanda, registra a venda na tabela 'vendas' e libera a mesa."""
-    data = request.get_json()
-    valor_pago = float(data.get('valor_pago', 0.0))
+@corpo_json('metodo_pagamento', 'valor_pago', erro='Método de pagamento e valor pago são obrigatórios.', tipos={'valor_pago': float})
+def registrar_pagamento_comanda(data, comanda_id):
+    """Fecha uma comanda, dá baixa nos insumos das fichas técnicas, registra a venda e libera a mesa."""
+    valor_pago = data['valor_pago']
     metodo_pagamento = data.get('metodo_pagamento')
     
     if not metodo_pagamento or valor_pago <= 0:
-        return jsonify({'error': 'Método de pagamento e valor pago são obrigatórios.'}), 400
+        return erro_fixo('Método de pagamento e valor pago são obrigatórios.', 400)
 
     db = get_db_connection()
     cursor = db.cursor()
-    is_postgres = os.environ.get('DATABASE_URL') is not None
     
     try:
+        # 0. Abre a transação de forma explícita, travando a comanda antes de qualquer leitura
+        #    (evita que dois pagamentos simultâneos fechem a mesma comanda ou baixem o estoque duas vezes)
+        if IS_POSTGRES:
+            cursor.execute(sql_conexao(db, 'lock_comanda'), (comanda_id,))
+        else:
+            cursor.execute("BEGIN IMMEDIATE")
+
         # 1. Calcular o Valor Total da Comanda (usando preco_unitario de comanda_itens)
-        query_total = '''
-            SELECT 
-                c.mesa_id, c.status,
-                COALESCE(SUM(ci.quantidade * ci.preco_unitario), 0.0) as valor_total
-            FROM comandas c
-            LEFT JOIN comanda_itens ci ON c.id = ci.comanda_id
-            WHERE c.id = %s GROUP BY c.id, c.mesa_id, c.status
-        ''' if is_postgres else '''
-            SELECT 
-                c.mesa_id, c.status,
-                COALESCE(SUM(ci.quantidade * ci.preco_unitario), 0.0) as valor_total
-            FROM comandas c
-            LEFT JOIN comanda_itens ci ON c.id = ci.comanda_id
-            WHERE c.id = ? GROUP BY c.id, c.mesa_id, c.status
-        '''
-        cursor.execute(query_total, (comanda_id,))
+        cursor.execute(sql_conexao(db, 'sel_total_comanda'), (comanda_id,))
         comanda_info = cursor.fetchone()
         
         if not comanda_info:
+            db.rollback()
             return jsonify({'error': f'Comanda ID {comanda_id} não encontrada.'}), 404
 
-        comanda_dict = dict(comanda_info)
-        mesa_id = comanda_dict['mesa_id']
-        valor_total = float(comanda_dict['valor_total'])
+        mesa_id = comanda_info['mesa_id']
+        valor_total = float(comanda_info['valor_total'])
         troco = max(0.0, valor_pago - valor_total) # Calcula o troco
 
-        if comanda_dict['status'] != 'aberta':
+        if comanda_info['status'] != 'aberta':
+            db.rollback()
             return jsonify({'error': f'Comanda {comanda_id} não está aberta.'}), 409
 
-        # 2. Registrar a Venda na tabela 'vendas'
-        query_insert_venda = '''
-            INSERT INTO vendas (comanda_id, valor_total, valor_pago, troco, metodo_pagamento) 
-            VALUES (%s, %s, %s, %s, %s) RETURNING id
-        ''' if is_postgres else '''
-            INSERT INTO vendas (comanda_id, valor_total, valor_pago, troco, metodo_pagamento) 
-            VALUES (?, ?, ?, ?, ?)
-        '''
-        cursor.execute(query_insert_venda, (comanda_id, valor_total, valor_pago, troco, metodo_pagamento))
-        
-        # 3. Fechar a Comanda (Atualiza status para 'paga' e data_fechamento)
+        # 2. Baixa automática de insumos (Ficha Técnica), em lote:
+        #    uma consulta (itens x fichas x insumos, agregada por insumo, travando os insumos em
+        #    ordem de id) e um UPDATE condicional que baixa e confere o saldo de todo o estoque de uma vez
+        cursor.execute(sql_conexao(db, 'sel_necessidades_comanda'), (comanda_id,))
+        necessidades = cursor.fetchall()
+
+        if necessidades:
+            valores = ', '.join([f'({PH}, {PH})'] * len(necessidades))
+            params = [v for row in necessidades for v in (row['id'], row['necessario'])]
+            cursor.execute(SQL['baixa_estoque_lote'].format(valores=valores), params)
+            baixados = {row['id'] for row in cursor.fetchall()}
+
+            # Algum insumo sem saldo: o UPDATE não o baixou e a venda inteira é desfeita
+            if len(baixados) < len(necessidades):
+                db.rollback()
+                faltantes = [row['nome'] for row in necessidades if row['id'] not in baixados]
+                return jsonify({'error': f'Estoque insuficiente para: {", ".join(faltantes)}.'}), 409
+
         now_str = datetime.now().isoformat()
-        query_update_comanda = "UPDATE comandas SET status = %s, data_fechamento = %s, total = %s WHERE id = %s" if is_postgres else "UPDATE comandas SET status = ?, data_fechamento = ?, total = ? WHERE id = ?"
-        cursor.execute(query_update_comanda, ('paga', now_str, valor_total, comanda_id))
-        
-        # 4. Liberar a Mesa (Atualiza status para 'disponivel')
-        query_update_mesa = "UPDATE mesas SET status = %s WHERE id = %s" if is_postgres else "UPDATE mesas SET status = ? WHERE id = ?"
-        cursor.execute(query_update_mesa, ('disponivel', mesa_id))
+
+        if IS_POSTGRES:
+            # 3 a 5 num único statement (ver SQL['finaliza_pagamento'])
+            cursor.execute(sql_conexao(db, 'finaliza_pagamento'), (
+                comanda_id, valor_total, valor_pago, troco, metodo_pagamento,
+                now_str, valor_total, comanda_id,
+                mesa_id,
+            ))
+        else:
+            # 3. Registrar a Venda na tabela 'vendas'
+            cursor.execute(SQL['ins_venda'], (comanda_id, valor_total, valor_pago, troco, metodo_pagamento))
+            
+            # 4. Fechar a Comanda (Atualiza status para 'paga' e data_fechamento)
+            cursor.execute(SQL['fechar_comanda'], ('paga', now_str, valor_total, comanda_id))
+            
+            # 5. Liberar a Mesa (Atualiza status para 'disponivel')
+            cursor.execute(sql_conexao(db, 'upd_mesa_status'), ('disponivel', mesa_id))
         
         db.commit()
+        invalidar_catalogo('insumos')
         
         return jsonify({
             'message': f'Comanda {comanda_id} paga e fechada. Mesa {mesa_id} liberada.',
@@ -609,34 +1247,23 @@ def registrar_pagamento_comanda(comanda_id):
 @app.route('/api/insumos', methods=['GET'])
 def get_insumos():
     """Lista todos os insumos"""
-    try:
+    def carregar():
         db = get_db_connection()
-        cursor = db.cursor()
-        cursor.execute('''
-    SELECT id, nome, unidade_medida, quantidade_estoque, estoque_minimo, preco_unitario, fornecedor 
-    FROM insumos ORDER BY nome
-''')
-        insumos = cursor.fetchall()
-        
-        # Converte para lista de dicionários
-        insumos_list = []
-        for insumo in insumos:
-            insumos_list.append(dict(insumo))
-        
-        return jsonify(insumos_list), 200
+        cursor = cursor_tuplas(db)
+        cursor.execute(SQL['sel_insumos'])
+        return linhas_por_colunas(cursor, COLUNAS_INSUMO)
+
+    try:
+        return resposta_catalogo('insumos', carregar)
     except Exception as e:
         return jsonify({'error': f'Erro ao buscar insumos: {str(e)}'}), 500
 
 # Rota de adicionar insumo corrigida para ter o prefixo /api e método POST
 @app.route('/api/insumos', methods=['POST']) 
-def add_insumo():
+@corpo_json('nome', 'unidade_medida', erro='Nome e unidade de medida são obrigatórios')
+def add_insumo(data):
     """Adiciona um novo insumo (Resolve Erro 405 ao Cadastrar)"""
     try:
-        data = request.get_json()
-        
-        if not data or 'nome' not in data or 'unidade_medida' not in data:
-            return jsonify({'error': 'Nome e unidade de medida são obrigatórios'}), 400
-        
         nome = data['nome'].strip()
         unidade_medida = data['unidade_medida'].strip()
         quantidade_estoque = float(data.get('quantidade_estoque', 0))
@@ -645,43 +1272,23 @@ def add_insumo():
         fornecedor = data.get('fornecedor', '').strip()
         
         if not nome or not unidade_medida:
-            return jsonify({'error': 'Nome e unidade de medida não podem estar vazios'}), 400
+            return erro_fixo('Nome e unidade de medida não podem estar vazios', 400)
         
         if quantidade_estoque < 0 or estoque_minimo < 0 or preco_unitario < 0:
-            return jsonify({'error': 'Valores numéricos não podem ser negativos'}), 400
+            return erro_fixo('Valores numéricos não podem ser negativos', 400)
         
         db = get_db_connection()
         cursor = db.cursor()
         
-        is_postgres = os.environ.get('DATABASE_URL') is not None
-        
         # Inserir todos os campos que estão no schema.sql
-        if is_postgres:
-            query = '''
-                INSERT INTO insumos (nome, unidade_medida, quantidade_estoque, estoque_minimo, preco_unitario, fornecedor) 
-                VALUES (%s, %s, %s, %s, %s, %s) 
-                RETURNING id, nome, unidade_medida, quantidade_estoque, estoque_minimo, preco_unitario, fornecedor
-            '''
-            cursor.execute(
-                query,
-                (nome, unidade_medida, quantidade_estoque, estoque_minimo, preco_unitario, fornecedor)
-            )
-            insumo = dict(cursor.fetchone())
-        else:
-            query = '''
-                INSERT INTO insumos (nome, unidade_medida, quantidade_estoque, estoque_minimo, preco_unitario, fornecedor) 
-                VALUES (?, ?, ?, ?, ?, ?)
-            '''
-            cursor.execute(
-                query,
-                (nome, unidade_medida, quantidade_estoque, estoque_minimo, preco_unitario, fornecedor)
-            )
-            new_id = cursor.lastrowid
-            # Busca o insumo completo para retornar
-            cursor.execute('SELECT id, nome, unidade_medida, quantidade_estoque, estoque_minimo, preco_unitario, fornecedor FROM insumos WHERE id = ?', (new_id,))
-            insumo = dict(cursor.fetchone())
+        cursor.execute(
+            SQL['ins_insumo'],
+            (nome, unidade_medida, quantidade_estoque, estoque_minimo, preco_unitario, fornecedor)
+        )
+        insumo = dict(cursor.fetchone())
 
         db.commit()
+        invalidar_catalogo('insumos')
         return jsonify(insumo), 201
         
     except ValueError as e:
@@ -691,61 +1298,64 @@ def add_insumo():
 
 # ROTA NOVA: Atualizar Insumo (PUT)
 @app.route('/api/insumos/<int:insumo_id>', methods=['PUT'])
-def update_insumo(insumo_id):
+@corpo_json(erro='Nenhum campo para atualizar')
+def update_insumo(data, insumo_id):
     """Atualiza um insumo existente pelo ID"""
     try:
-        data = request.get_json()
         db = get_db_connection()
         cursor = db.cursor()
-        is_postgres = os.environ.get('DATABASE_URL') is not None
         
-        updates = []
+        campos = []
         values = []
 
         if 'nome' in data:
-            updates.append('nome = %s' if is_postgres else 'nome = ?')
+            campos.append('nome')
             values.append(data['nome'].strip())
         if 'unidade_medida' in data:
-            updates.append('unidade_medida = %s' if is_postgres else 'unidade_medida = ?')
+            campos.append('unidade_medida')
             values.append(data['unidade_medida'].strip())
         if 'quantidade_estoque' in data:
             quantidade_estoque = float(data['quantidade_estoque'])
             if quantidade_estoque < 0:
-                return jsonify({'error': 'Estoque não pode ser negativo'}), 400
-            updates.append('quantidade_estoque = %s' if is_postgres else 'quantidade_estoque = ?')
+                return erro_fixo('Estoque não pode ser negativo', 400)
+            campos.append('quantidade_estoque')
             values.append(quantidade_estoque)
         if 'estoque_minimo' in data:
             estoque_minimo = float(data['estoque_minimo'])
             if estoque_minimo < 0:
-                return jsonify({'error': 'Estoque mínimo não pode ser negativo'}), 400
-            updates.append('estoque_minimo = %s' if is_postgres else 'estoque_minimo = ?')
+                return erro_fixo('Estoque mínimo não pode ser negativo', 400)
+            campos.append('estoque_minimo')
             values.append(estoque_minimo)
         if 'preco_unitario' in data:
             preco_unitario = float(data['preco_unitario'])
             if preco_unitario < 0:
-                return jsonify({'error': 'Preço unitário não pode ser negativo'}), 400
-            updates.append('preco_unitario = %s' if is_postgres else 'preco_unitario = ?')
+                return erro_fixo('Preço unitário não pode ser negativo', 400)
+            campos.append('preco_unitario')
             values.append(preco_unitario)
         if 'fornecedor' in data:
-            updates.append('fornecedor = %s' if is_postgres else 'fornecedor = ?')
+            campos.append('fornecedor')
             values.append(data['fornecedor'].strip())
 
-        if not updates:
-            return jsonify({'error': 'Nenhum campo para atualizar'}), 400
+        if not campos:
+            return erro_fixo('Nenhum campo para atualizar', 400)
         
         values.append(insumo_id)
-        query = f"UPDATE insumos SET {', '.join(updates)} WHERE id = {'%s' if is_postgres else '?'}"
+        query = sql_update('insumos', tuple(campos), SQL['ret_insumo'])
         
         cursor.execute(query, values)
+        insumo = cursor.fetchone()
         db.commit()
         
-        if cursor.rowcount == 0:
-            return jsonify({'error': 'Insumo não encontrado'}), 404
+        if insumo is None:
+            return erro_fixo('Insumo não encontrado', 404)
         
-        return jsonify({'message': 'Insumo atualizado com sucesso'}), 200
+        invalidar_catalogo('insumos')
+        invalidar_catalogo('fichas')  # nome/unidade do insumo aparecem nas fichas
+        # Devolve a linha já atualizada para o cliente não precisar recarregá-la
+        return jsonify({'message': 'Insumo atualizado com sucesso', **dict(insumo)}), 200
         
     except ValueError:
-        return jsonify({'error': 'Valor de estoque ou unidade inválido'}), 400
+        return erro_fixo('Valor de estoque ou unidade inválido', 400)
     except Exception as e:
         return jsonify({'error': f'Erro ao atualizar insumo: {str(e)}'}), 500
 
@@ -756,21 +1366,23 @@ def delete_insumo(insumo_id):
     try:
         db = get_db_connection()
         cursor = db.cursor()
-        is_postgres = os.environ.get('DATABASE_URL') is not None
-        
-        query = 'DELETE FROM insumos WHERE id = %s' if is_postgres else 'DELETE FROM insumos WHERE id = ?'
-        
-        cursor.execute(query, (insumo_id,))
+        cursor.execute(SQL['del_insumo'], (insumo_id, insumo_id))
+        removidos = cursor.rowcount
         db.commit()
         
-        if cursor.rowcount == 0:
-            return jsonify({'error': 'Insumo não encontrado'}), 404
+        if removidos == 0:
+            # Caminho raro: descobre se o insumo não existe ou se está em uso
+            cursor.execute(SQL['existe_insumo'], (insumo_id,))
+            if cursor.fetchone() is None:
+                return erro_fixo('Insumo não encontrado', 404)
+            return erro_fixo('Não é possível remover. Este insumo é usado em uma Ficha Técnica.', 409)
         
+        invalidar_catalogo('insumos')
         return jsonify({'message': 'Insumo removido com sucesso'}), 200
         
     except Exception as e:
-        if 'violates foreign key constraint' in str(e):
-             return jsonify({'error': 'Não é possível remover. Este insumo é usado em uma Ficha Técnica.'}), 409
+        if 'violates foreign key constraint' in str(e) or 'FOREIGN KEY constraint failed' in str(e):
+             return erro_fixo('Não é possível remover. Este insumo é usado em uma Ficha Técnica.', 409)
         return jsonify({'error': f'Erro ao remover insumo: {str(e)}'}), 500
 
 
@@ -779,38 +1391,23 @@ def delete_insumo(insumo_id):
 # ========================================
 
 # ROTA: Alerta de Estoque Baixo 
+# O dashboard chama /api/insumos/estoque-baixo e tira do tamanho da lista a contagem do card
+# de alertas: contagem e lista vêm da mesma resposta em cache (sem COUNT separado)
 @app.route('/api/estoque-baixo', methods=['GET'])
+@app.route('/api/insumos/estoque-baixo', methods=['GET'])
 def estoque_baixo():
     """Retorna a lista de insumos com estoque abaixo do mínimo"""
-    try:
+    def carregar():
         db = get_db_connection()
         cursor = db.cursor()
-        
-        query = '''
-            SELECT id, nome, unidade_medida, quantidade_estoque, estoque_minimo
-            FROM insumos
-            WHERE quantidade_estoque <= estoque_minimo
-            ORDER BY nome
-        '''
-        
-        cursor.execute(query)
-        alertas = cursor.fetchall()
-        
-        alertas_list = []
-        for alerta in alertas:
-            alerta_dict = dict(alerta) if not isinstance(alerta, dict) else alerta
-            alertas_list.append({
-                "id": alerta_dict['id'],
-                "nome": alerta_dict['nome'],
-                "estoque_atual": alerta_dict['quantidade_estoque'],
-                "unidade_medida": alerta_dict['unidade_medida'],
-                "estoque_minimo": alerta_dict['estoque_minimo']
-            })
-            
-        return jsonify(alertas_list), 200
-    
+        cursor.execute(SQL['sel_estoque_baixo'])
+        return fetchall_dicts(cursor)
+
+    try:
+        # Muda junto com os insumos: descartado pelas mesmas escritas (cadastro, edição, pagamento)
+        return resposta_catalogo('insumos', carregar, chave='insumos:estoque-baixo')
     except Exception as e:
-        print(f"Erro ao buscar estoque baixo: {str(e)}")
+        app.logger.exception('Erro ao buscar estoque baixo')
         return jsonify({'error': f'Erro ao buscar alertas de estoque: {str(e)}'}), 500
 
 # ROTA: Total de Produtos
@@ -821,17 +1418,12 @@ def total_produtos():
         db = get_db_connection()
         cursor = db.cursor()
         
-        cursor.execute("SELECT COUNT(*) as total FROM produtos")
-        resultado = cursor.fetchone()
-        
-        if isinstance(resultado, dict) or (resultado and hasattr(resultado, 'keys')):
-            total_produtos = resultado['total']
-        else:
-            total_produtos = resultado[0] if resultado else 0
+        cursor.execute(SQL['conta_produtos'])
+        total_produtos = cursor.fetchone()['total']
         
         return jsonify({"total_produtos": total_produtos}), 200
     except Exception as e:
-        print(f"Erro ao buscar total de produtos: {str(e)}")
+        app.logger.exception('Erro ao buscar total de produtos')
         return jsonify({"total_produtos": 0, "error": str(e)}), 500
 
 # Rotas do Dashboard (MOCKADOS para não quebrar o frontend)
@@ -854,49 +1446,39 @@ def produtos_mais_vendidos():
 @app.route('/api/produtos', methods=['GET'])
 def get_produtos():
     """Lista todos os produtos."""
-    try:
+    def carregar():
         db = get_db_connection()
-        cursor = db.cursor()
-        cursor.execute('SELECT id, nome, preco_venda FROM produtos ORDER BY nome')
-        produtos = cursor.fetchall()
-        return jsonify([dict(row) for row in produtos]), 200
+        cursor = cursor_tuplas(db)
+        cursor.execute(SQL['sel_produtos'])
+        return linhas_por_colunas(cursor, COLUNAS_PRODUTO)
+
+    try:
+        return resposta_catalogo('produtos', carregar)
     except Exception as e:
         return jsonify({'error': f'Erro ao listar produtos: {str(e)}'}), 500
 
 @app.route('/api/produtos', methods=['POST'])
-def add_produto():
+@corpo_json('nome', 'preco_venda', erro='Nome e preço de venda são obrigatórios')
+def add_produto(data):
     """Adiciona um novo produto."""
     try:
         db = get_db_connection()
         cursor = db.cursor()
-        data = request.get_json()
-        
-        if not data or 'nome' not in data or 'preco_venda' not in data:
-            return jsonify({'error': 'Nome e preço de venda são obrigatórios'}), 400
         
         nome = data['nome'].strip()
         preco_venda = float(data['preco_venda'])
         
         if not nome:
-            return jsonify({'error': 'Nome não pode estar vazio'}), 400
+            return erro_fixo('Nome não pode estar vazio', 400)
         
         if preco_venda <= 0:
-            return jsonify({'error': 'Preço deve ser maior que zero'}), 400
-        
-        is_postgres = os.environ.get('DATABASE_URL') is not None
+            return erro_fixo('Preço deve ser maior que zero', 400)
         
-        if is_postgres:
-            query = 'INSERT INTO produtos (nome, preco_venda) VALUES (%s, %s) RETURNING id, nome, preco_venda'
-            cursor.execute(query, (nome, preco_venda))
-            produto = dict(cursor.fetchone())
-        else:
-            query = 'INSERT INTO produtos (nome, preco_venda) VALUES (?, ?)'
-            cursor.execute(query, (nome, preco_venda))
-            produto_id = cursor.lastrowid
-            cursor.execute('SELECT id, nome, preco_venda FROM produtos WHERE id = ?', (produto_id,))
-            produto = dict(cursor.fetchone())
+        cursor.execute(SQL['ins_produto'], (nome, preco_venda))
+        produto = dict(cursor.fetchone())
 
         db.commit()
+        invalidar_catalogo('produtos')
         return jsonify(produto), 201
         
     except ValueError as e:
@@ -906,43 +1488,43 @@ def add_produto():
         return jsonify({'error': f'Erro ao adicionar produto: {str(e)}'}), 500
 
 @app.route('/api/produtos/<int:produto_id>', methods=['PUT'])
-def update_produto(produto_id):
+@corpo_json(erro='Nenhum campo para atualizar')
+def update_produto(data, produto_id):
     """Atualiza um produto existente."""
     try:
-        data = request.get_json()
         db = get_db_connection()
         cursor = db.cursor()
-        is_postgres = os.environ.get('DATABASE_URL') is not None
         
-        updates = []
+        campos = []
         values = []
 
         if 'nome' in data:
-            updates.append('nome = %s' if is_postgres else 'nome = ?')
+            campos.append('nome')
             values.append(data['nome'].strip())
         if 'preco_venda' in data:
             preco_venda = float(data['preco_venda'])
             if preco_venda <= 0:
-                return jsonify({'error': 'Preço deve ser maior que zero'}), 400
-            updates.append('preco_venda = %s' if is_postgres else 'preco_venda = ?')
+                return erro_fixo('Preço deve ser maior que zero', 400)
+            campos.append('preco_venda')
             values.append(preco_venda)
 
-        if not updates:
-            return jsonify({'error': 'Nenhum campo para atualizar'}), 400
+        if not campos:
+            return erro_fixo('Nenhum campo para atualizar', 400)
         
         values.append(produto_id)
-        query = f"UPDATE produtos SET {', '.join(updates)} WHERE id = {'%s' if is_postgres else '?'}"
+        query = sql_update('produtos', tuple(campos))
         
         cursor.execute(query, values)
         db.commit()
+        invalidar_catalogo('produtos')
         
         if cursor.rowcount == 0:
-            return jsonify({'error': 'Produto não encontrado'}), 404
+            return erro_fixo('Produto não encontrado', 404)
         
         return jsonify({'message': 'Produto atualizado com sucesso'}), 200
         
     except ValueError:
-        return jsonify({'error': 'Valor de preço inválido'}), 400
+        return erro_fixo('Valor de preço inválido', 400)
     except Exception as e:
         db.rollback()
         return jsonify({'error': f'Erro ao atualizar produto: {str(e)}'}), 500
@@ -953,15 +1535,13 @@ def delete_produto(produto_id):
     try:
         db = get_db_connection()
         cursor = db.cursor()
-        is_postgres = os.environ.get('DATABASE_URL') is not None
-        
-        query = 'DELETE FROM produtos WHERE id = %s' if is_postgres else 'DELETE FROM produtos WHERE id = ?'
-        
-        cursor.execute(query, (produto_id,))
+        cursor.execute(SQL['del_produto'], (produto_id,))
         db.commit()
+        invalidar_catalogo('produtos')
+        invalidar_catalogo('fichas')  # a ficha do produto sai junto (ON DELETE CASCADE)
         
         if cursor.rowcount == 0:
-            return jsonify({'error': 'Produto não encontrado'}), 404
+            return erro_fixo('Produto não encontrado', 404)
         
         return jsonify({'message': 'Produto removido com sucesso'}), 200
         
@@ -969,15 +1549,118 @@ def delete_produto(produto_id):
         # Verifica se o erro é de chave estrangeira
         if 'violates foreign key constraint' in str(e) or 'FOREIGN KEY constraint failed' in str(e):
             db.rollback()
-            return jsonify({'error': 'Não é possível remover. Este produto está em uma Comanda ou Ficha Técnica.'}), 409
+            return erro_fixo('Não é possível remover. Este produto está em uma Comanda ou Ficha Técnica.', 409)
         
         db.rollback()
         return jsonify({'error': f'Erro ao remover produto: {str(e)}'}), 500
 
 
+# ========================================
+# ROTAS DE FICHAS TÉCNICAS
+# ========================================
+
+# Limite de linhas por INSERT multi-VALUES no SQLite (3 parâmetros por linha, máx. 999 variáveis)
+FICHA_ITENS_POR_LOTE = 300
+# Idem para as listas de produtos (cabeçalhos das fichas e o IN que os relê): 1 parâmetro por produto
+PRODUTOS_POR_LOTE = 900
+
+@app.route('/api/fichas_tecnicas/<int:produto_id>', methods=['GET'])
+def get_ficha_tecnica(produto_id):
+    """Lista os insumos da ficha técnica de um produto (servida do cache até a próxima escrita)."""
+    def carregar():
+        db = get_db_connection()
+        cursor = db.cursor()
+        cursor.execute(sql_conexao(db, 'sel_ficha_produto'), (produto_id,))
+        return fetchall_dicts(cursor)
+
+    try:
+        return resposta_catalogo('fichas', carregar, chave=f'fichas:{produto_id}')
+    except Exception as e:
+        return jsonify({'error': f'Erro ao buscar ficha técnica: {str(e)}'}), 500
+
+@app.route('/api/fichas_tecnicas/bulk', methods=['POST'])
+@corpo_json('itens', erro='Informe a lista de itens da ficha técnica.')
+def add_fichas_tecnicas_bulk(data):
+    """Adiciona vários insumos às fichas técnicas em uma única requisição e transação."""
+    itens = data['itens']
+
+    if not itens or not isinstance(itens, list):
+        return erro_fixo('Informe a lista de itens da ficha técnica.', 400)
+
+    try:
+        linhas = {}  # (produto_id, insumo_id) -> quantidade; repetições no lote ficam com o último valor
+        for item in itens:
+            if not isinstance(item, dict):
+                return erro_fixo('Cada item precisa de produto_id, insumo_id e quantidade_necessaria.', 400)
+            # O produto pode vir em cada item ou uma única vez no corpo (ficha de um só produto)
+            produto_id = item.get('produto_id', data.get('produto_id'))
+            if produto_id is None or 'insumo_id' not in item or 'quantidade_necessaria' not in item:
+                return erro_fixo('Cada item precisa de produto_id, insumo_id e quantidade_necessaria.', 400)
+            quantidade_necessaria = float(item['quantidade_necessaria'])
+            # NaN e infinito passam pelo float() e não teriam como ser baixados do estoque
+            if not math.isfinite(quantidade_necessaria):
+                return erro_fixo('Valores inválidos na lista de itens.', 400)
+            if quantidade_necessaria <= 0:
+                return erro_fixo('Quantidade necessária deve ser maior que zero.', 400)
+            linhas[(int(produto_id), int(item['insumo_id']))] = quantidade_necessaria
+    except (ValueError, TypeError):
+        return erro_fixo('Valores inválidos na lista de itens.', 400)
+
+    db = get_db_connection()
+    cursor = db.cursor()
+
+    try:
+        if not IS_POSTGRES:
+            cursor.execute("BEGIN")
+
+        # 1. Garante o cabeçalho da ficha (uma por produto) com INSERTs multi-VALUES, em lotes
+        produto_ids = list({produto_id for produto_id, _ in linhas})
+        ficha_por_produto = {}
+        for inicio in range(0, len(produto_ids), PRODUTOS_POR_LOTE):
+            lote = produto_ids[inicio:inicio + PRODUTOS_POR_LOTE]
+            cursor.execute(
+                f"INSERT INTO fichas_tecnicas (produto_id) VALUES {', '.join([f'({PH})'] * len(lote))} "
+                "ON CONFLICT (produto_id) DO NOTHING",
+                lote
+            )
+            cursor.execute(
+                f"SELECT id, produto_id FROM fichas_tecnicas WHERE produto_id IN ({', '.join([PH] * len(lote))})",
+                lote
+            )
+            ficha_por_produto.update((row['produto_id'], row['id']) for row in cursor.fetchall())
+        valores = [(ficha_por_produto[produto_id], insumo_id, qtd) for (produto_id, insumo_id), qtd in linhas.items()]
+
+        # 2. Insere (ou atualiza) todos os itens de uma vez
+        upsert = 'ON CONFLICT (ficha_id, insumo_id) DO UPDATE SET quantidade_necessaria = EXCLUDED.quantidade_necessaria'
+        if IS_POSTGRES:
+            # execute_values monta o VALUES (...),(...) e já faz a paginação
+            execute_values(
+                cursor,
+                f'INSERT INTO ficha_itens (ficha_id, insumo_id, quantidade_necessaria) VALUES %s {upsert}',
+                valores
+            )
+        else:
+            for inicio in range(0, len(valores), FICHA_ITENS_POR_LOTE):
+                lote = valores[inicio:inicio + FICHA_ITENS_POR_LOTE]
+                cursor.execute(
+                    f"INSERT INTO ficha_itens (ficha_id, insumo_id, quantidade_necessaria) VALUES {', '.join(['(?, ?, ?)'] * len(lote))} {upsert}",
+                    [valor for linha in lote for valor in linha]
+                )
+
+        db.commit()
+        invalidar_catalogo('fichas')
+        return jsonify({'message': f'{len(valores)} itens de ficha técnica registrados com sucesso.', 'total': len(valores)}), 201
+
+    except Exception as e:
+        db.rollback()
+        if 'violates foreign key constraint' in str(e) or 'FOREIGN KEY constraint failed' in str(e):
+            return erro_fixo('Produto ou insumo informado não existe.', 404)
+        return jsonify({'error': f'Erro ao registrar itens da ficha técnica: {str(e)}'}), 500
+
+
 if __name__ == '__main__':
-    # Cria o banco de dados SQLite local se não existir
-    if not os.environ.get('DATABASE_URL') and not os.path.exists(DATABASE):
+    # Cria o banco de dados SQLite local se não existir (ou se ainda estiver sem tabelas)
+    if not IS_POSTGRES and sqlite_sem_schema():
         try:
             init_db()
             print("Banco de dados SQLite inicializado (desenvolvimento).")
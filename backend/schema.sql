@@ -26,6 +26,9 @@ CREATE TABLE insumos (
     preco_unitario REAL NOT NULL DEFAULT 0.0,
     fornecedor TEXT
 );
+-- Alerta de estoque baixo: o índice parcial só contém os insumos abaixo do mínimo, já na ordem
+-- da resposta (nome); a consulta lê apenas os alertas, não a tabela inteira
+CREATE INDEX IF NOT EXISTS idx_insumos_estoque_baixo ON insumos (nome) WHERE quantidade_estoque <= estoque_minimo;
 
 CREATE TABLE produtos (
     id SERIAL PRIMARY KEY, 
@@ -41,6 +44,9 @@ CREATE TABLE usuarios (
     data_criacao TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Busca de usuário sem diferenciar maiúsculas/minúsculas (login e cadastro)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_usuarios_username_lower ON usuarios (LOWER(username));
+
 -- ========================================
 -- FICHAS TÉCNICAS (ESTRUTURA CORRIGIDA para 1:N)
 -- ========================================
@@ -63,6 +69,11 @@ CREATE TABLE ficha_itens ( -- Tabela de Insumos da Ficha
     UNIQUE (ficha_id, insumo_id) -- Garante que um insumo só aparece uma vez na mesma ficha
 );
 
+-- Índice de cobertura para a baixa de estoque (ficha -> insumo, quantidade sem ler a tabela)
+CREATE INDEX IF NOT EXISTS idx_ficha_itens_cobertura ON ficha_itens (ficha_id, insumo_id, quantidade_necessaria);
+-- Verificação da FK ao remover um insumo ("está em alguma ficha?")
+CREATE INDEX IF NOT EXISTS idx_ficha_itens_insumo ON ficha_itens (insumo_id);
+
 -- ========================================
 -- TABELAS PDV/COMANDAS/MESAS
 -- ========================================
@@ -98,6 +109,15 @@ CREATE TABLE comanda_itens (
     FOREIGN KEY (comanda_id) REFERENCES comandas (id) ON DELETE CASCADE,
     FOREIGN KEY (produto_id) REFERENCES produtos (id) ON DELETE RESTRICT
 );
+-- Uma linha por produto na comanda: repetir o produto soma a quantidade (ON CONFLICT do add_item).
+-- O índice também atende as buscas por comanda (totais, detalhe, baixa de estoque).
+CREATE UNIQUE INDEX IF NOT EXISTS idx_comanda_itens_comanda_produto ON comanda_itens (comanda_id, produto_id);
+-- Comandas de uma mesa por status (ex.: a comanda aberta da mesa)
+CREATE INDEX IF NOT EXISTS idx_comandas_mesa_status ON comandas (mesa_id, status);
+-- No máximo uma comanda aberta por mesa, garantido pelo banco mesmo com aberturas simultâneas
+CREATE UNIQUE INDEX IF NOT EXISTS idx_comandas_uma_aberta_por_mesa ON comandas (mesa_id) WHERE status = 'aberta';
+-- Listagem filtrada por status, já na ordem de abertura
+CREATE INDEX IF NOT EXISTS idx_comandas_status_abertura ON comandas (status, data_abertura);
 
 -- ========================================
 -- TABELA VENDAS (Corrigida a restrição)
@@ -121,4 +141,4 @@ CREATE TABLE vendas (
     
     -- CRÍTICO: Garantir integridade referencial com RESTRICT
     FOREIGN KEY (comanda_id) REFERENCES comandas (id) ON DELETE RESTRICT
-);
\ No newline at end of file
+);
@@ -0,0 +1,68 @@
+"""Fixtures dos testes: cada teste roda o app contra um banco SQLite novo, num diretório temporário.
+
+Rodar a partir da raiz do repositório:  python -m pytest backend/tests
+"""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+os.environ.pop('DATABASE_URL', None)
+
+import app as nexus  # noqa: E402
+
+
+def schema_sqlite(arquivo='schema.sql'):
+    """O schema (escrito para o PostgreSQL) no dialeto do SQLite, como no desenvolvimento local."""
+    with open(os.path.join(BACKEND, arquivo)) as f:
+        schema = f.read()
+    return schema.replace('SERIAL PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT').replace(' CASCADE;', ';')
+
+
+def reiniciar_estado():
+    """Descarta o pool e os caches em memória do módulo (valem por processo, não por banco)."""
+    pool = nexus._pool
+    if pool is not None:
+        while not pool.empty():
+            pool.get_nowait().close()
+    nexus._pool = None
+    nexus._catalogo_cache.clear()
+    nexus._catalogo_versao.clear()
+    nexus._logins_verificados.clear()
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    """Conexão com um banco novo (restaurante.db em tmp_path), já com o schema atual."""
+    monkeypatch.chdir(tmp_path)
+    reiniciar_estado()
+    conexao = sqlite3.connect(nexus.DATABASE)
+    conexao.executescript(schema_sqlite())
+    conexao.commit()
+    yield conexao
+    conexao.close()
+    reiniciar_estado()
+
+
+@pytest.fixture
+def client(banco):
+    return nexus.app.test_client()
+
+
+@pytest.fixture
+def comanda_com_ficha(banco, client):
+    """Mesa 1 com a comanda 1 aberta e 3 Burgers lançados; cada Burger gasta 0.1 kg de Carne."""
+    banco.executescript('''
+        INSERT INTO produtos (nome, preco_venda) VALUES ('Burger', 20);
+        INSERT INTO insumos (nome, unidade_medida, quantidade_estoque) VALUES ('Carne', 'kg', 1);
+        INSERT INTO fichas_tecnicas (produto_id) VALUES (1);
+        INSERT INTO ficha_itens (ficha_id, insumo_id, quantidade_necessaria) VALUES (1, 1, 0.1);
+        INSERT INTO mesas (numero, capacidade) VALUES (1, 4);
+    ''')
+    banco.commit()
+    assert client.post('/api/comandas', json={'mesa_id': 1}).status_code == 201
+    assert client.post('/api/comandas/1/itens', json={'produto_id': 1, 'quantidade': 3}).status_code == 201
+    return 1
@@ -0,0 +1,66 @@
+"""Cache dos catálogos: ETag/304, descarte nas escritas e limite de respostas guardadas."""
+import app as nexus
+
+
+def test_etag_e_304_enquanto_o_catalogo_nao_muda(client):
+    assert client.post('/api/insumos', json={'nome': 'Carne', 'unidade_medida': 'kg'}).status_code == 201
+
+    primeira = client.get('/api/insumos')
+    etag = primeira.headers['ETag']
+    repetida = client.get('/api/insumos', headers={'If-None-Match': etag})
+
+    assert primeira.status_code == 200
+    assert repetida.status_code == 304
+    assert repetida.get_data() == b''
+
+
+def test_escrita_descarta_o_cache(client):
+    client.post('/api/insumos', json={'nome': 'Carne', 'unidade_medida': 'kg'})
+    etag = client.get('/api/insumos').headers['ETag']
+
+    client.put('/api/insumos/1', json={'quantidade_estoque': 7})
+    resposta = client.get('/api/insumos', headers={'If-None-Match': etag})
+
+    assert resposta.status_code == 200
+    assert resposta.headers['ETag'] != etag
+    assert resposta.get_json()[0]['quantidade_estoque'] == 7
+
+
+def test_ficha_descartada_quando_o_insumo_muda(client):
+    client.post('/api/produtos', json={'nome': 'Burger', 'preco_venda': 20})
+    client.post('/api/insumos', json={'nome': 'Carne', 'unidade_medida': 'kg'})
+    client.post('/api/fichas_tecnicas/bulk', json={'itens': [{'produto_id': 1, 'insumo_id': 1, 'quantidade_necessaria': 0.1}]})
+    etag = client.get('/api/fichas_tecnicas/1').headers['ETag']
+
+    client.put('/api/insumos/1', json={'nome': 'Picanha'})
+    resposta = client.get('/api/fichas_tecnicas/1', headers={'If-None-Match': etag})
+
+    assert resposta.status_code == 200
+    assert 'Picanha' in resposta.get_data(as_text=True)
+
+
+def test_cache_descarta_as_respostas_menos_usadas(client, monkeypatch):
+    monkeypatch.setattr(nexus, 'CATALOGO_CACHE_MAX', 3)
+
+    for produto_id in (1, 2, 3):
+        client.get(f'/api/fichas_tecnicas/{produto_id}')
+    client.get('/api/fichas_tecnicas/1')
+    client.get('/api/fichas_tecnicas/4')
+
+    assert list(nexus._catalogo_cache) == ['fichas:3', 'fichas:1', 'fichas:4']
+
+
+def test_mesas_sem_cache_mas_com_etag(banco, client):
+    banco.execute('INSERT INTO mesas (numero, capacidade) VALUES (1, 4)')
+    banco.commit()
+    etag = client.get('/api/mesas').headers['ETag']
+
+    assert client.get('/api/mesas', headers={'If-None-Match': etag}).status_code == 304
+    # Mudança feita por outro worker (direto no banco) aparece na hora
+    banco.execute("UPDATE mesas SET status = 'suja'")
+    banco.commit()
+    resposta = client.get('/api/mesas', headers={'If-None-Match': etag})
+
+    assert resposta.status_code == 200
+    assert resposta.get_json()[0]['status'] == 'suja'
+    assert not any(chave.startswith('mesas') for chave in nexus._catalogo_cache)
@@ -0,0 +1,48 @@
+"""Abertura de comandas: uma comanda aberta por mesa, mesmo com pedidos simultâneos."""
+import threading
+
+import app as nexus
+
+
+def test_aberturas_simultaneas_na_mesma_mesa(banco):
+    banco.execute('INSERT INTO mesas (numero, capacidade) VALUES (1, 4)')
+    banco.commit()
+
+    tentativas = 8
+    barreira = threading.Barrier(tentativas)
+    status = []
+
+    def abrir():
+        client = nexus.app.test_client()
+        barreira.wait()
+        status.append(client.post('/api/comandas', json={'mesa_id': 1}).status_code)
+
+    threads = [threading.Thread(target=abrir) for _ in range(tentativas)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(status) == [201] + [409] * (tentativas - 1)
+    assert banco.execute("SELECT COUNT(*) FROM comandas WHERE mesa_id = 1 AND status = 'aberta'").fetchone()[0] == 1
+    assert banco.execute('SELECT status FROM mesas WHERE id = 1').fetchone()[0] == 'ocupada'
+
+
+def test_mesa_liberada_a_mao_com_comanda_aberta(banco, client):
+    banco.execute('INSERT INTO mesas (numero, capacidade) VALUES (1, 4)')
+    banco.commit()
+    assert client.post('/api/comandas', json={'mesa_id': 1}).status_code == 201
+    # Alguém marca a mesa como disponível sem pagar a comanda: o índice parcial barra a segunda
+    assert client.put('/api/mesas/1', json={'status': 'disponivel'}).status_code == 200
+
+    resposta = client.post('/api/comandas', json={'mesa_id': 1})
+
+    assert resposta.status_code == 409
+    assert resposta.get_json() == {'error': 'Esta mesa já possui uma comanda aberta.'}
+    assert banco.execute('SELECT COUNT(*) FROM comandas').fetchone()[0] == 1
+
+
+def test_abrir_comanda_em_mesa_inexistente(client):
+    resposta = client.post('/api/comandas', json={'mesa_id': 99})
+
+    assert resposta.status_code == 404
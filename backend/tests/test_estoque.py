@@ -0,0 +1,23 @@
+"""Alerta de estoque baixo: as duas rotas, a mesma resposta e o índice parcial."""
+import app as nexus
+
+
+def test_estoque_baixo_nas_duas_rotas(banco, client):
+    banco.executescript('''
+        INSERT INTO insumos (nome, unidade_medida, quantidade_estoque, estoque_minimo) VALUES
+            ('Tomate', 'kg', 1, 2), ('Alface', 'un', 5, 5), ('Carne', 'kg', 10, 2);
+    ''')
+    banco.commit()
+
+    antiga = client.get('/api/estoque-baixo')
+    dashboard = client.get('/api/insumos/estoque-baixo')
+
+    assert antiga.status_code == dashboard.status_code == 200
+    assert [i['nome'] for i in dashboard.get_json()] == ['Alface', 'Tomate']
+    assert dashboard.get_data() == antiga.get_data()
+    assert dashboard.headers['ETag'] == antiga.headers['ETag']
+
+
+def test_estoque_baixo_usa_o_indice_parcial(banco):
+    plano = banco.execute('EXPLAIN QUERY PLAN ' + nexus.SQL['sel_estoque_baixo']).fetchall()
+    assert any('idx_insumos_estoque_baixo' in linha[-1] for linha in plano)
@@ -0,0 +1,86 @@
+"""Cadastro de fichas técnicas em lote (/api/fichas_tecnicas/bulk)."""
+import sqlite3
+
+import pytest
+
+import app as nexus
+
+
+def bulk(client, corpo):
+    return client.post('/api/fichas_tecnicas/bulk', json=corpo)
+
+
+@pytest.fixture
+def catalogo(banco):
+    banco.executescript('''
+        INSERT INTO produtos (nome, preco_venda) VALUES ('Burger', 20);
+        INSERT INTO insumos (nome, unidade_medida) VALUES ('Carne', 'kg'), ('Pao', 'un');
+    ''')
+    banco.commit()
+    return banco
+
+
+def test_registra_e_atualiza_itens(client, catalogo):
+    resposta = bulk(client, {'produto_id': 1, 'itens': [
+        {'insumo_id': 1, 'quantidade_necessaria': 0.2},
+        {'insumo_id': 2, 'quantidade_necessaria': 1},
+        {'insumo_id': 1, 'quantidade_necessaria': 0.15},  # repetido: fica o último valor
+    ]})
+
+    assert resposta.status_code == 201
+    assert resposta.get_json()['total'] == 2
+    assert catalogo.execute('SELECT insumo_id, quantidade_necessaria FROM ficha_itens ORDER BY insumo_id').fetchall() == [
+        (1, 0.15), (2, 1.0)]
+
+
+@pytest.mark.parametrize('corpo, erro', [
+    ({'itens': []}, 'Informe a lista de itens da ficha técnica.'),
+    ({'itens': {'insumo_id': 1}}, 'Informe a lista de itens da ficha técnica.'),
+    ({'itens': [1, 2]}, 'Cada item precisa de produto_id, insumo_id e quantidade_necessaria.'),
+    ({'itens': [{'insumo_id': 1, 'quantidade_necessaria': 1}]}, 'Cada item precisa de produto_id, insumo_id e quantidade_necessaria.'),
+    ({'itens': [{'produto_id': 1, 'insumo_id': 'x', 'quantidade_necessaria': 1}]}, 'Valores inválidos na lista de itens.'),
+    ({'itens': [{'produto_id': 1, 'insumo_id': 1, 'quantidade_necessaria': 'nan'}]}, 'Valores inválidos na lista de itens.'),
+    ({'itens': [{'produto_id': 1, 'insumo_id': 1, 'quantidade_necessaria': 'inf'}]}, 'Valores inválidos na lista de itens.'),
+    ({'itens': [{'produto_id': 1, 'insumo_id': 1, 'quantidade_necessaria': 0}]}, 'Quantidade necessária deve ser maior que zero.'),
+    ({'itens': [{'produto_id': 1, 'insumo_id': 1, 'quantidade_necessaria': -1}]}, 'Quantidade necessária deve ser maior que zero.'),
+])
+def test_rejeita_corpo_invalido(client, catalogo, corpo, erro):
+    resposta = bulk(client, corpo)
+
+    assert resposta.status_code == 400
+    assert resposta.get_json() == {'error': erro}
+    assert catalogo.execute('SELECT COUNT(*) FROM ficha_itens').fetchone()[0] == 0
+
+
+def test_insumo_inexistente_desfaz_o_lote(client, catalogo):
+    resposta = bulk(client, {'produto_id': 1, 'itens': [
+        {'insumo_id': 1, 'quantidade_necessaria': 0.2},
+        {'insumo_id': 99, 'quantidade_necessaria': 1},
+    ]})
+
+    assert resposta.status_code == 404
+    assert catalogo.execute('SELECT COUNT(*) FROM ficha_itens').fetchone()[0] == 0
+    assert catalogo.execute('SELECT COUNT(*) FROM fichas_tecnicas').fetchone()[0] == 0
+
+
+def test_lote_com_mais_produtos_que_o_limite_de_variaveis(client, banco, monkeypatch):
+    # SQLite >= 3.32 aceita 32766 variáveis; o limite antigo (999) é imposto na conexão do app
+    conectar = nexus._connect_sqlite
+
+    def conectar_com_limite():
+        db = conectar()
+        db.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+        return db
+
+    monkeypatch.setattr(nexus, '_connect_sqlite', conectar_com_limite)
+    total = nexus.PRODUTOS_POR_LOTE + 100
+    banco.executemany('INSERT INTO produtos (nome, preco_venda) VALUES (?, 1)', [(f'P{i}',) for i in range(total)])
+    banco.execute("INSERT INTO insumos (nome, unidade_medida) VALUES ('Sal', 'g')")
+    banco.commit()
+
+    resposta = bulk(client, {'itens': [
+        {'produto_id': produto_id, 'insumo_id': 1, 'quantidade_necessaria': 0.5} for produto_id in range(1, total + 1)]})
+
+    assert resposta.status_code == 201
+    assert banco.execute('SELECT COUNT(*) FROM fichas_tecnicas').fetchone()[0] == total
+    assert banco.execute('SELECT COUNT(*) FROM ficha_itens').fetchone()[0] == total
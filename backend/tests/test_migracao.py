@@ -0,0 +1,99 @@
+"""Migração na subida do app: bancos criados antes dos índices novos, com dados que os violam."""
+import logging
+
+import pytest
+
+import app as nexus
+
+INDICES = [objeto for objeto, _ in nexus.MIGRACOES]
+
+
+@pytest.fixture
+def banco_antigo(banco):
+    """Banco no schema atual, mas sem os índices de MIGRACOES (como um banco criado antes deles)."""
+    for indice in INDICES:
+        banco.execute(f'DROP INDEX {indice}')
+    banco.executescript('''
+        INSERT INTO produtos (nome, preco_venda) VALUES ('Burger', 20), ('Suco', 5);
+        INSERT INTO mesas (numero, capacidade) VALUES (1, 4), (2, 4);
+        INSERT INTO usuarios (username, password_hash) VALUES ('admin', 'x'), ('outro', 'y');
+    ''')
+    banco.commit()
+    return banco
+
+
+def migrar():
+    nexus._get_pool()
+
+
+def indices(banco):
+    return {linha[0] for linha in banco.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_cria_os_indices_que_faltam(banco_antigo):
+    migrar()
+
+    assert set(INDICES) <= indices(banco_antigo)
+
+
+def test_funde_itens_repetidos_da_comanda(banco_antigo):
+    banco_antigo.executescript('''
+        INSERT INTO comandas (mesa_id) VALUES (1);
+        INSERT INTO comanda_itens (comanda_id, produto_id, quantidade, preco_unitario)
+        VALUES (1, 1, 1, 18), (1, 2, 1, 5), (1, 1, 2, 20);
+    ''')
+    banco_antigo.commit()
+
+    migrar()
+
+    itens = banco_antigo.execute(
+        'SELECT produto_id, quantidade, preco_unitario FROM comanda_itens ORDER BY produto_id').fetchall()
+    assert itens[0][:2] == (1, 3)
+    assert itens[0][2] == pytest.approx(58 / 3)  # total da comanda continua 58 + 5
+    assert itens[1] == (2, 1, 5.0)
+    assert 'idx_comanda_itens_comanda_produto' in indices(banco_antigo)
+
+
+def test_usuarios_repetidos_nao_sao_renomeados(banco_antigo, caplog):
+    banco_antigo.execute("INSERT INTO usuarios (username, password_hash) VALUES ('Admin', 'z')")
+    banco_antigo.commit()
+
+    with caplog.at_level(logging.ERROR):
+        migrar()
+
+    assert banco_antigo.execute('SELECT username FROM usuarios ORDER BY id').fetchall() == [
+        ('admin',), ('outro',), ('Admin',)]
+    assert 'idx_usuarios_username_lower' not in indices(banco_antigo)
+    assert "(1, 'admin'), (3, 'Admin')" in caplog.text
+    # Os demais passos seguem normalmente
+    assert 'idx_comandas_uma_aberta_por_mesa' in indices(banco_antigo)
+
+
+def test_comandas_abertas_repetidas_nao_sao_alteradas(banco_antigo, caplog):
+    banco_antigo.executescript('''
+        INSERT INTO comandas (mesa_id) VALUES (1), (1), (2);
+        INSERT INTO comanda_itens (comanda_id, produto_id, quantidade, preco_unitario) VALUES (1, 1, 1, 20), (2, 1, 1, 20);
+    ''')
+    banco_antigo.commit()
+
+    with caplog.at_level(logging.ERROR):
+        migrar()
+
+    assert banco_antigo.execute('SELECT id, status FROM comandas ORDER BY id').fetchall() == [
+        (1, 'aberta'), (2, 'aberta'), (3, 'aberta')]
+    assert banco_antigo.execute('SELECT comanda_id FROM comanda_itens ORDER BY id').fetchall() == [(1,), (2,)]
+    assert 'idx_comandas_uma_aberta_por_mesa' not in indices(banco_antigo)
+    assert '(1, 1), (1, 2)' in caplog.text
+
+
+def test_indice_criado_depois_de_corrigir_os_dados(banco_antigo):
+    banco_antigo.execute("INSERT INTO usuarios (username, password_hash) VALUES ('Admin', 'z')")
+    banco_antigo.commit()
+    migrar()
+
+    banco_antigo.execute("UPDATE usuarios SET username = 'admin2' WHERE username = 'Admin'")
+    banco_antigo.commit()
+    nexus._pool = None  # nova subida do app
+    migrar()
+
+    assert 'idx_usuarios_username_lower' in indices(banco_antigo)
@@ -0,0 +1,49 @@
+"""Pagamento da comanda: baixa de estoque pelas fichas técnicas, bloqueando a venda sem saldo."""
+import pytest
+
+
+def pagar(client, comanda_id):
+    return client.post(f'/api/comandas/{comanda_id}/pagar', json={'valor_pago': 100, 'metodo_pagamento': 'pix'})
+
+
+def estoque(banco, nome):
+    return banco.execute('SELECT quantidade_estoque FROM insumos WHERE nome = ?', (nome,)).fetchone()[0]
+
+
+def test_pagamento_baixa_os_insumos_da_ficha(banco, client, comanda_com_ficha):
+    resposta = pagar(client, comanda_com_ficha)
+
+    assert resposta.status_code == 200
+    assert resposta.get_json()['valor_total'] == 60.0
+    assert estoque(banco, 'Carne') == pytest.approx(0.7)
+    assert banco.execute('SELECT status FROM comandas WHERE id = 1').fetchone()[0] == 'paga'
+    assert banco.execute('SELECT status FROM mesas WHERE id = 1').fetchone()[0] == 'disponivel'
+
+
+def test_pagamento_com_estoque_insuficiente_e_bloqueado(banco, client, comanda_com_ficha):
+    banco.execute("UPDATE insumos SET quantidade_estoque = 0.2 WHERE nome = 'Carne'")
+    banco.commit()
+
+    resposta = pagar(client, comanda_com_ficha)
+
+    assert resposta.status_code == 409
+    assert resposta.get_json() == {'error': 'Estoque insuficiente para: Carne.'}
+    # Nada da venda fica gravado: estoque, comanda, mesa e vendas como antes
+    assert estoque(banco, 'Carne') == 0.2
+    assert banco.execute('SELECT status FROM comandas WHERE id = 1').fetchone()[0] == 'aberta'
+    assert banco.execute('SELECT status FROM mesas WHERE id = 1').fetchone()[0] == 'ocupada'
+    assert banco.execute('SELECT COUNT(*) FROM vendas').fetchone()[0] == 0
+
+
+def test_pagamento_pode_usar_exatamente_o_estoque_restante(banco, client, comanda_com_ficha):
+    # 0.3 - 3 x 0.1 não dá exatamente zero em ponto flutuante
+    banco.execute("UPDATE insumos SET quantidade_estoque = 0.3 WHERE nome = 'Carne'")
+    banco.commit()
+
+    assert pagar(client, comanda_com_ficha).status_code == 200
+    assert estoque(banco, 'Carne') == 0.0
+
+
+def test_pagamento_de_comanda_ja_paga(client, comanda_com_ficha):
+    assert pagar(client, comanda_com_ficha).status_code == 200
+    assert pagar(client, comanda_com_ficha).status_code == 409